@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Compares plain dicts with the slotted records for memory and access time.
+
+    python -m benchmarks.bench_records [n]
+"""
+import sys
+import timeit
+import tracemalloc
+from webnlg_corpus.records import Triple, Lex
+
+
+def make_triple_dict(i):
+
+    return {'text': 'text', 'subject': 'subject', 'predicate': 'predicate',
+            'object': i}
+
+
+def make_triple_record(i):
+
+    return Triple('text', 'subject', 'predicate', i)
+
+
+def make_lex_dict(i):
+
+    return {'text': 'text', 'template': 'template', 'comment': 'good',
+            'lid': i}
+
+
+def make_lex_record(i):
+
+    return Lex('text', 'template', 'good', i)
+
+
+def allocated_bytes(factory, n):
+
+    tracemalloc.start()
+    objects = [factory(i) for i in range(n)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del objects
+
+    return size / n
+
+
+def main(n=100000):
+
+    triple_dict = make_triple_dict(0)
+    triple_record = make_triple_record(0)
+
+    results = {
+        'triple dict bytes': allocated_bytes(make_triple_dict, n),
+        'triple record bytes': allocated_bytes(make_triple_record, n),
+        'lex dict bytes': allocated_bytes(make_lex_dict, n),
+        'lex record bytes': allocated_bytes(make_lex_record, n),
+        'dict item access ns': timeit.timeit(
+            lambda: triple_dict['predicate'], number=n) / n * 1e9,
+        'record attribute access ns': timeit.timeit(
+            lambda: triple_record.predicate, number=n) / n * 1e9,
+    }
+
+    for name, value in results.items():
+        print('{:<28}{:>10.1f}'.format(name, value))
+
+
+if __name__ == '__main__':
+
+    main(*map(int, sys.argv[1:]))
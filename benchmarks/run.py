@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""End-to-end benchmarks for loading and querying a release.
+
+    python -m benchmarks.run [--data DIR | --synthetic N] [--release NAME]
+                             [--repeat N] [--output FILE]
+
+Each benchmark is timed --repeat times and run once more under tracemalloc
+to get its peak memory. Results are written as JSON. Without --data the
+benchmarks run on a temporary copy of the small fixture release bundled in
+benchmarks/fixtures, so snapshots are never written into the repository;
+--synthetic N generates a temporary release of N entries instead.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from webnlg_corpus.synthetic import generate_release
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'fixtures', 'webnlg_data')
+
+
+def make_benchmarks(release):
+    """Returns (name, setup) pairs; setup prepares state outside the timing
+    and returns the function to time."""
+
+    from webnlg_corpus import webnlg
+    from webnlg_corpus.downloader import (get_release_datasets_dir,
+                                          get_dataset_files)
+
+    corpus = webnlg.load(release, cache=False)
+    idxs = [entry.idx for entry in corpus]
+
+    def load_cold():
+        return lambda: webnlg.load(release, cache=False)
+
+    def load_warm():
+        webnlg.load(release)
+        return lambda: webnlg.load(release)
+
+    def read_webnlg_file():
+
+        files = [(dataset, filepath)
+                 for dataset in get_release_datasets_dir(release)
+                 for filepath in get_dataset_files(release, dataset)]
+
+        def run():
+            for dataset, filepath in files:
+                webnlg.read_webnlg_file(dataset, filepath)
+
+        return run
+
+    def subset():
+        return lambda: corpus.subset(datasets=['train'], ntriples=[1, 2])
+
+    def sample():
+
+        def run():
+            for seed in range(100):
+                corpus.sample(seed=seed)
+
+        return run
+
+    def sample_many():
+
+        def run():
+            corpus.sample(n=min(1000, len(corpus)), seed=0,
+                          stratify_by='category')
+
+        return run
+
+    def lookup():
+
+        def run():
+            for idx in idxs:
+                corpus[idx]
+
+        return run
+
+    def iteration():
+
+        def run():
+            for entry in corpus:
+                entry.data
+
+        return run
+
+    def iter_batches():
+
+        def run():
+            for batch in corpus.iter_batches(256, shuffle=True, seed=0):
+                pass
+
+        return run
+
+    def as_pandas():
+        # a fresh view over every entry has no cached frames
+        return lambda: corpus.subset(ntriples=range(1, 8)).as_pandas
+
+    return [(function.__name__, function) for function in [
+        load_cold, load_warm, read_webnlg_file, subset, sample, sample_many,
+        lookup, iteration, iter_batches, as_pandas
+    ]], len(corpus)
+
+
+def measure(setup, repeat):
+
+    run = setup()
+
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'best_s': min(times),
+        'median_s': statistics.median(times),
+        'peak_bytes': peak,
+        'runs': repeat
+    }
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data', help='download dir holding the release; '
+                        'defaults to a copy of the bundled fixture')
+    parser.add_argument('--synthetic', type=int, metavar='N',
+                        help='benchmark a generated release of N entries')
+    parser.add_argument('--release', default='release_v2')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='JSON file; defaults to stdout')
+    args = parser.parse_args(argv)
+
+    temp_dir = None
+
+    if args.data is None:
+
+        temp_dir = tempfile.mkdtemp()
+        args.data = os.path.join(temp_dir, 'webnlg_data')
+
+        if args.synthetic:
+            generate_release(args.release, args.synthetic,
+                             download_dir=args.data)
+        else:
+            shutil.copytree(FIXTURES_DIR, args.data)
+
+    os.environ['WEBNLG_DATA'] = args.data
+
+    try:
+        benchmarks, entries = make_benchmarks(args.release)
+
+        results = []
+
+        for name, setup in benchmarks:
+            results.append(dict(name=name, **measure(setup, args.repeat)))
+
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+
+    report = {
+        'release': args.release,
+        'entries': entries,
+        'python': platform.python_version(),
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+
+    main()
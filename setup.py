@@ -21,7 +21,10 @@ setup(name='webnlg_corpus',
               'Topic :: Scientific/Engineering :: Artificial Intelligence'
               ],
       install_requires=[
-              'pandas',
-              'tinydb'
-              ]
+              'numpy',
+              'pandas'
+              ],
+      extras_require={
+              'arrow': ['pyarrow']
+              }
       )
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+import http.server
+import os
+import re
+import socket
+import tempfile
+import threading
+import unittest
+from webnlg_corpus.downloader import fetch
+
+DATA = bytes(range(256)) * 1024
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Serves server.data with an ETag, honouring Range and If-Range unless
+    the server says otherwise, and dropping the connection halfway through
+    while server.drops > 0.
+
+    server.skew shifts the start of the ranges sent, to mimic a server that
+    answers a Range request with the wrong bytes.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+
+        pass
+
+    def do_GET(self):
+
+        server = self.server
+        data = server.data
+        etag = '"{}"'.format(server.version)
+
+        requested = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        server.requests.append((requested, if_range))
+
+        start = 0
+
+        if (requested is not None and server.honour_range and
+                if_range in (None, etag)):
+
+            start = int(re.match(r'bytes=(\d+)-', requested).group(1))
+
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range',
+                                 'bytes */{}'.format(len(data)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            start += server.skew
+
+        body = data[start:]
+
+        self.send_response(206 if start else 200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+
+        if start:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                             start, len(data) - 1, len(data)))
+
+        self.end_headers()
+
+        if server.drops:
+
+            server.drops -= 1
+
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+            return
+
+        self.wfile.write(body)
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+
+    def handle_error(self, request, client_address):
+
+        # fetch hangs up on responses it rejects, mid-body
+        pass
+
+
+class FetchTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.server = StandInServer(('127.0.0.1', 0), StandInHandler)
+        self.server.data = DATA
+        self.server.version = 1
+        self.server.drops = 0
+        self.server.honour_range = True
+        self.server.skew = 0
+        self.server.requests = []
+
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+
+        self.url = 'http://127.0.0.1:{}/release.zip'.format(
+                self.server.server_address[1])
+
+        self.dirpath = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.dirpath.name, 'release.zip.part')
+
+    def tearDown(self):
+
+        self.server.shutdown()
+        self.server.server_close()
+        self.dirpath.cleanup()
+
+    def read(self):
+
+        with open(self.filepath, 'rb') as f:
+            return f.read()
+
+    def interrupt(self):
+        """Leaves the first half of the file in filepath and returns its
+        size."""
+
+        self.server.drops = 1
+
+        with self.assertRaises(IOError) as raised:
+            fetch(self.url, self.filepath, chunk_size=4096)
+
+        written = os.path.getsize(self.filepath)
+
+        self.assertEqual(raised.exception.transferred, written)
+        self.assertTrue(0 < written < len(DATA))
+
+        return written
+
+    def test_resumes_after_dropped_connection(self):
+
+        written = self.interrupt()
+
+        transferred = fetch(self.url, self.filepath, chunk_size=4096)
+
+        self.assertEqual(self.read(), DATA)
+        self.assertEqual(transferred, len(DATA) - written)
+        self.assertEqual(self.server.requests,
+                         [(None, None), ('bytes={}-'.format(written), '"1"')])
+        self.assertFalse(os.path.exists(self.filepath + '.validator'))
+
+    def test_restarts_when_range_is_ignored(self):
+
+        self.server.honour_range = False
+        self.interrupt()
+
+        transferred = fetch(self.url, self.filepath, chunk_size=4096)
+
+        self.assertEqual(self.read(), DATA)
+        self.assertEqual(transferred, len(DATA))
+        self.assertIsNotNone(self.server.requests[-1][0])
+
+    def test_restarts_when_file_changed(self):
+
+        self.interrupt()
+
+        self.server.data = DATA[::-1]
+        self.server.version = 2
+
+        transferred = fetch(self.url, self.filepath, chunk_size=4096)
+
+        self.assertEqual(self.read(), DATA[::-1])
+        self.assertEqual(transferred, len(DATA))
+
+    def test_restarts_when_range_starts_elsewhere(self):
+
+        self.interrupt()
+
+        self.server.skew = 10
+
+        transferred = fetch(self.url, self.filepath, chunk_size=4096)
+
+        self.assertEqual(self.read(), DATA)
+        self.assertEqual(transferred, len(DATA))
+
+    def test_complete_file_gets_416(self):
+
+        fetch(self.url, self.filepath)
+
+        transferred = fetch(self.url, self.filepath)
+
+        self.assertEqual(transferred, 0)
+        self.assertEqual(self.read(), DATA)
+        self.assertEqual(self.server.requests[-1][0],
+                         'bytes={}-'.format(len(DATA)))
+
+    def test_longer_stale_file_is_replaced(self):
+
+        with open(self.filepath, 'wb') as f:
+            f.write(DATA + bytes(1000))
+
+        transferred = fetch(self.url, self.filepath)
+
+        self.assertEqual(transferred, len(DATA))
+        self.assertEqual(self.read(), DATA)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+import tempfile
+from .downloader import get_release_dir, stat_dataset_file
+
+
+def get_snapshot_filepath(release):
+
+    return get_release_dir(release) + '.snapshot'
+
+
+def snapshot_key(release, filepaths, parser_version):
+    """Identifies the parsed state of a release.
+
+    Any added, removed or modified XML file, or a new parser version, gives
+    a different key and so invalidates the snapshot.
+    """
+
+    release_dir = get_release_dir(release)
+
+    files = []
+
+    for filepath in filepaths:
+
+        files.append((os.path.relpath(filepath, release_dir),
+                      *stat_dataset_file(filepath)))
+
+    return (parser_version, tuple(files))
+
+
+def read_snapshot(filepath, key):
+    """Returns the data stored at filepath, or None if there is no snapshot
+    or it was written for another key."""
+
+    try:
+        with open(filepath, 'rb') as f:
+
+            if pickle.load(f) != key:
+                return None
+
+            return pickle.load(f)
+
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def write_snapshot(filepath, key, data):
+
+    dirpath = os.path.dirname(filepath)
+
+    try:
+        fd, temp_filepath = tempfile.mkstemp(dir=dirpath, suffix='.tmp')
+    except OSError:
+        # read-only data dir: loading still works, just without a snapshot
+        return
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+
+            pickle.dump(key, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(temp_filepath, filepath)
+
+    except OSError:
+        # out of space or quota, say: same as a read-only data dir
+        _remove_temp(temp_filepath)
+
+    except BaseException:
+        _remove_temp(temp_filepath)
+        raise
+
+
+def _remove_temp(temp_filepath):
+
+    try:
+        os.remove(temp_filepath)
+    except OSError:
+        pass
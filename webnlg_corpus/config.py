@@ -2,4 +2,14 @@ RELEASES_URLS = {
         'webnlg_challenge_2017': 'https://github.com/abevieiramota/webnlg-corpus/releases/download/initial-releases/webnlg_challenge_2017.zip',
         'release_v2': 'https://github.com/abevieiramota/webnlg-corpus/releases/download/initial-releases/release_v2.zip',
         'release_v2_constrained': 'https://github.com/abevieiramota/webnlg-corpus/releases/download/initial-releases/release_v2_constrained.zip'
-        }
\ No newline at end of file
+        }
+
+# SHA-256 of each release zip, checked by downloader.download before
+# extraction. For a release left at None, download pins the digest of its
+# first download in <download dir>/<release>.sha256 and checks later
+# downloads against that.
+RELEASES_SHA256 = {
+        'webnlg_challenge_2017': None,
+        'release_v2': None,
+        'release_v2_constrained': None
+        }
@@ -1,11 +1,42 @@
 # -*- coding: utf-8 -*-
-from urllib import request
-from .config import RELEASES_URLS
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit, urlunsplit
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import http.client
+import threading
+import time
+from .config import RELEASES_URLS, RELEASES_SHA256
 import os
 import sys
 import zipfile
 import glob
 import shutil
+import tempfile
+import warnings
+from contextlib import contextmanager
+import re
+
+if sys.platform == 'win32':
+    import msvcrt
+else:
+    import fcntl
+
+
+NTRIPLES_DIR = re.compile(r'(\d+)triples')
+
+# "bytes 100-199/1000", or "bytes */1000" in a 416
+CONTENT_RANGE = re.compile(r'bytes (?:(\d+)-\d+|\*)/(\d+|\*)')
+
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# error is None for a release downloaded (or already there) and the
+# exception raised otherwise
+DOWNLOAD_STATS = namedtuple('DOWNLOAD_STATS',
+                            ['bytes', 'seconds', 'bytes_per_second',
+                             'error'],
+                            defaults=[None])
 
 
 def get_release_dir(release):
@@ -13,11 +44,30 @@ def get_release_dir(release):
     return os.path.join(default_download_dir(), release)
 
 
+def get_release_zip(release):
+
+    return get_release_dir(release) + '.zip'
+
+
 def get_release_datasets_dir(release):
+    """Yields the dataset names of a release, read from its extracted
+    directory or, if there is none, from its kept zip."""
 
     release_dir = get_release_dir(release)
 
-    for dataset_dirpath in glob.iglob(os.path.join(release_dir, '*/')):
+    if not os.path.isdir(release_dir) and os.path.isfile(
+            get_release_zip(release)):
+
+        members = _release_zip_members(release)
+
+        yield from sorted({member.split('/')[1] for member in members
+                           if member.count('/') > 1})
+
+        return
+
+    dataset_dirpaths = glob.glob(os.path.join(release_dir, '*/'))
+
+    for dataset_dirpath in sorted(dataset_dirpaths):
 
         dataset_name = os.path.basename(os.path.normpath(dataset_dirpath))
 
@@ -25,16 +75,127 @@ def get_release_datasets_dir(release):
 
 
 def get_dataset_files(release, dataset):
+    """Lists the XML files of a dataset.
+
+    For a release kept as a zip the files are paths through the zip, like
+    ~/webnlg_data/release_v2.zip/release_v2/train/1triples/Airport.xml,
+    which open_dataset_file knows how to open.
+    """
 
     release_dir = get_release_dir(release)
+
+    if not os.path.isdir(release_dir) and os.path.isfile(
+            get_release_zip(release)):
+
+        release_zip = get_release_zip(release)
+        prefix = '{}/{}/'.format(release, dataset)
+
+        return sorted(
+            os.path.join(release_zip, *member.split('/'))
+            for member in _release_zip_members(release)
+            if member.startswith(prefix) and member.endswith('.xml')
+        )
+
     dataset_dir = os.path.join(release_dir, dataset)
 
-    return glob.glob(os.path.join(dataset_dir, '**/*.xml'), recursive=True)
+    return sorted(glob.glob(os.path.join(dataset_dir, '**/*.xml'),
+                            recursive=True))
+
+
+def _release_zip_members(release):
+
+    with zipfile.ZipFile(get_release_zip(release)) as zip_ref:
+
+        return zip_ref.namelist()
+
+
+def split_zip_path(filepath):
+    """Splits a path through a zip into the zip path and the member name;
+    returns None for other paths."""
+
+    marker = '.zip' + os.sep
+    position = filepath.find(marker)
+
+    if position == -1:
+        return None
+
+    return (filepath[:position + len('.zip')],
+            filepath[position + len(marker):].replace(os.sep, '/'))
+
+
+def open_dataset_file(filepath):
+    """Opens a dataset file for binary reading, either from disk or from
+    inside a release zip."""
+
+    zip_path = None if os.path.isfile(filepath) else split_zip_path(filepath)
+
+    if zip_path is None:
+        return open(filepath, 'rb')
+
+    zip_filepath, member = zip_path
+
+    # the member keeps the underlying file open after the zip is closed
+    with zipfile.ZipFile(zip_filepath) as zip_ref:
+
+        return zip_ref.open(member)
+
+
+def stat_dataset_file(filepath):
+    """Returns the size and modification time of a dataset file; for a
+    file inside a zip, those of the zip."""
+
+    zip_path = None if os.path.isfile(filepath) else split_zip_path(filepath)
+
+    if zip_path is not None:
+        filepath = zip_path[0]
+
+    stat = os.stat(filepath)
+
+    return stat.st_size, stat.st_mtime_ns
+
+
+def get_dataset_file_size(filepath):
+    """Returns the size of a dataset file in bytes; for a file inside a
+    zip, its uncompressed size."""
+
+    zip_path = None if os.path.isfile(filepath) else split_zip_path(filepath)
+
+    if zip_path is None:
+        return os.path.getsize(filepath)
+
+    zip_filepath, member = zip_path
+
+    with zipfile.ZipFile(zip_filepath) as zip_ref:
+
+        return zip_ref.getinfo(member).file_size
+
+
+def get_file_ntriples(filepath):
+    """Returns the number of triples of the entries in a dataset file,
+    taken from its "<n>triples" directory, or None if it has none."""
+
+    for part in reversed(os.path.normpath(filepath).split(os.sep)):
+
+        match = NTRIPLES_DIR.fullmatch(part)
+
+        if match:
+            return int(match.group(1))
+
+    return None
 
 
 # from https://github.com/nltk/nltk/blob/develop/nltk/downloader.py
 def default_download_dir():
 
+    # like NLTK_DATA, lets benchmarks and tests point at another data dir
+    if 'WEBNLG_DATA' in os.environ:
+        download_dir = os.environ['WEBNLG_DATA']
+
+        if not os.path.isdir(download_dir):
+            os.makedirs(download_dir)
+
+        return download_dir
+
     if sys.platform == 'win32' and 'APPDATA' in os.environ:
         homedir = os.environ['APPDATA']
 
@@ -51,27 +212,548 @@ def default_download_dir():
     return download_dir
 
 
-def download(release, force=False):
+class ConnectionPool(object):
+    """Keeps idle HTTP(S) connections by host, so that consecutive requests
+    to a host reuse one connection. It can be shared between threads."""
+
+    REDIRECTS = (301, 302, 303, 307, 308)
+
+    def __init__(self, timeout=60, max_redirects=5):
+
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def _connect(self, scheme, netloc):
+
+        if scheme == 'https':
+            connection = http.client.HTTPSConnection(netloc,
+                                                     timeout=self.timeout)
+        else:
+            connection = http.client.HTTPConnection(netloc,
+                                                    timeout=self.timeout)
+
+        # where release puts the connection back
+        connection.pool_key = (scheme, netloc)
+
+        return connection
+
+    def get(self, url, headers=None):
+        """Sends a GET request, following redirects.
+
+        Returns the final url, the response and its connection, which must
+        be handed back with release once the body is read, or closed.
+        """
+
+        for _ in range(self.max_redirects + 1):
+
+            parts = urlsplit(url)
+            key = (parts.scheme, parts.netloc)
+            path = urlunsplit(('', '', parts.path or '/', parts.query, ''))
+
+            with self._lock:
+                idle = self._idle[key]
+                reused = idle.pop() if idle else None
+
+            try:
+                connection, response = self._request(reused, key, path,
+                                                     headers)
+            except BaseException:
+                if reused is not None:
+                    reused.close()
+                raise
+
+            if response.status not in self.REDIRECTS:
+                return url, connection, response
+
+            location = response.getheader('Location')
+            response.read()
+            self.release(connection, response)
+
+            url = urljoin(url, location)
+
+        raise IOError('Too many redirects for {}'.format(url))
+
+    def _request(self, connection, key, path, headers):
+
+        if connection is not None:
+
+            try:
+                connection.request('GET', path, headers=headers or {})
+                return connection, connection.getresponse()
+            except (OSError, http.client.HTTPException):
+                # the server dropped the idle connection; open a new one
+                connection.close()
+
+        connection = self._connect(*key)
+        connection.request('GET', path, headers=headers or {})
+
+        return connection, connection.getresponse()
+
+    def release(self, connection, response):
+
+        if response.will_close:
+            connection.close()
+            return
+
+        with self._lock:
+            self._idle[connection.pool_key].append(connection)
+
+    def close(self):
+
+        with self._lock:
+
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+
+            self._idle.clear()
+
+
+def fetch(url, filepath, chunk_size=DOWNLOAD_CHUNK_SIZE, progress=None,
+          connections=None, sha256=None):
+    """Downloads url into filepath, chunk_size bytes at a time, and returns
+    the number of bytes transferred.
+
+    If filepath already holds part of the file, only the rest is requested,
+    with an HTTP Range header and, when the server sent one, an If-Range
+    validator (kept in filepath + '.validator') so that a file changed
+    since is sent whole instead. A whole file replaces the partial one, as
+    does a partial one the server's Content-Range does not fit. progress,
+    if given, is called after each chunk with the bytes downloaded so far
+    and the total size, or None if the server does not send it.
+
+    An interrupted download raises and leaves filepath in place, so a later
+    call resumes it; the exception has a transferred attribute with the
+    bytes written before it. Pass a ConnectionPool as connections to reuse
+    connections across calls.
+
+    With sha256, a hex digest, the file is hashed as it is written and
+    checked once complete; on a mismatch it is deleted and ValueError is
+    raised.
+    """
+
+    pool = connections if connections is not None else ConnectionPool()
+
+    try:
+        return _fetch(url, filepath, chunk_size, progress, pool, sha256)
+    finally:
+        if connections is None:
+            pool.close()
+
+
+def _fetch(url, filepath, chunk_size, progress, pool, sha256):
+
+    validator_filepath = filepath + '.validator'
+
+    while True:
+
+        offset = os.path.getsize(filepath) if os.path.isfile(filepath) else 0
+
+        headers = {}
+
+        if offset:
+
+            headers['Range'] = 'bytes={}-'.format(offset)
+
+            validator = _read_validator(validator_filepath)
+
+            if validator is not None:
+                headers['If-Range'] = validator
+
+        url, connection, response = pool.get(url, headers)
+
+        start, size = _parse_content_range(
+                response.getheader('Content-Range'))
+
+        if response.status == 416 and offset:
+
+            response.read()
+            pool.release(connection, response)
+
+            if size != offset:
+                # not the file on the server: start over
+                _remove_partial(filepath)
+                continue
+
+            # the partial file already has every byte
+            if sha256 is not None:
+                _check_sha256(filepath, _hash_file(filepath), sha256)
+
+            _remove_partial(validator_filepath)
+
+            return 0
+
+        if response.status == 206 and start != offset:
+            connection.close()
+            _remove_partial(filepath)
+            continue
+
+        break
+
+    transferred = 0
+
+    try:
+
+        if response.status not in (200, 206):
+            raise HTTPError(url, response.status, response.reason,
+                            response.headers, None)
+
+        if response.status == 200:
+            offset = 0
+            _write_validator(validator_filepath, response)
+
+        # only the bytes already on disk need to be read back to hash them
+        digest = _hash_file(filepath) if offset else hashlib.sha256()
+
+        length = response.getheader('Content-Length')
+        total = offset + int(length) if length is not None else size
+
+        with open(filepath, 'ab' if offset else 'wb') as f:
+
+            while True:
+
+                chunk = response.read(chunk_size)
+
+                if not chunk:
+                    break
+
+                f.write(chunk)
+                digest.update(chunk)
+                offset += len(chunk)
+                transferred += len(chunk)
+
+                if progress is not None:
+                    progress(offset, total)
+
+    except BaseException as error:
+        connection.close()
+        error.transferred = transferred
+        raise
+
+    if total is not None and offset < total:
+        connection.close()
+        error = IOError('Download of {} stopped at {} of {} bytes'.format(
+                        url, offset, total))
+        error.transferred = transferred
+        raise error
+
+    pool.release(connection, response)
+    _remove_partial(validator_filepath)
+
+    if sha256 is not None:
+        _check_sha256(filepath, digest, sha256)
+
+    return transferred
+
+
+def _parse_content_range(value):
+    """Returns the first byte and the total size in a Content-Range header,
+    each None when absent or unknown."""
+
+    match = CONTENT_RANGE.fullmatch(value.strip()) if value else None
+
+    if match is None:
+        return None, None
+
+    start, size = match.groups()
+
+    return (int(start) if start is not None else None,
+            int(size) if size != '*' else None)
+
+
+def _read_validator(validator_filepath):
+
+    try:
+        with open(validator_filepath) as f:
+            return f.read() or None
+    except OSError:
+        return None
+
+
+def _write_validator(validator_filepath, response):
+    """Keeps what identifies the version of the file being downloaded: a
+    strong ETag, or else its Last-Modified date."""
+
+    etag = response.getheader('ETag')
+
+    if etag is not None and etag.startswith('W/'):
+        etag = None
+
+    validator = etag or response.getheader('Last-Modified')
+
+    if validator is None:
+        _remove_partial(validator_filepath)
+        return
+
+    with open(validator_filepath, 'w') as f:
+        f.write(validator)
+
+
+def _remove_partial(filepath):
+
+    if os.path.isfile(filepath):
+        os.remove(filepath)
+
+
+def _hash_file(filepath):
+
+    digest = hashlib.sha256()
+
+    with open(filepath, 'rb') as f:
+
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest
+
+
+def _check_sha256(filepath, digest, sha256):
+
+    if digest.hexdigest() != sha256.lower():
+
+        os.remove(filepath)
+
+        raise ValueError('{} has SHA-256 {}, expected {}'.format(
+                         filepath, digest.hexdigest(), sha256))
+
+
+def _read_pinned_sha256(pinned_filepath):
+
+    try:
+        with open(pinned_filepath) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _pin_sha256(pinned_filepath, digest):
+
+    with open(pinned_filepath, 'w') as f:
+        f.write(digest.hexdigest() + '\n')
+
+
+def _check_zip(filepath):
+    """Raises ValueError, and deletes filepath, if it is not a readable zip
+    or a member fails its CRC check."""
+
+    try:
+        with zipfile.ZipFile(filepath) as zip_ref:
+            bad_member = zip_ref.testzip()
+    except zipfile.BadZipFile as error:
+        bad_member = error
+
+    if bad_member is not None:
+
+        os.remove(filepath)
+
+        raise ValueError('{} is not a valid zip: {}'.format(filepath,
+                                                            bad_member))
+
+
+def download(release, force=False, chunk_size=DOWNLOAD_CHUNK_SIZE,
+             progress=None, retries=3, extract=True, connections=None,
+             sha256=None):
+    """Downloads and extracts a release into the download directory, and
+    returns the number of bytes transferred.
+
+    The zip is fetched in chunks into <release>.zip.part; a failed attempt
+    is resumed from there, up to retries more times, including by a later
+    call after the process died.
+
+    With extract=False the zip is kept as <release>.zip instead, and the
+    release is read straight from it.
+
+    The zip is checked against sha256, or else config.RELEASES_SHA256, or
+    else the digest pinned in <release>.sha256 by an earlier download,
+    before it is extracted or kept. Without any, a warning is issued, the
+    CRCs of the zip members are checked instead and the digest of the zip
+    is pinned for later downloads.
+
+    Concurrent calls for a release, from any process, are serialized by a
+    lock file; a call that waited for another one to download the release
+    returns without downloading it again. The release is extracted into a
+    staging directory and renamed into place, so readers never see a
+    partial release.
+    """
 
     if release not in RELEASES_URLS:
         raise ValueError(f'{release} is not an available release name.'
                          'Available releases are {RELEASES.keys()}')
 
     release_dir = get_release_dir(release)
+    release_zip = get_release_zip(release)
+
+    downloaded_before = is_downloaded(release)
+
+    with release_lock(release):
+
+        if is_downloaded(release):
+
+            # another process downloaded it while this one waited
+            if not downloaded_before:
+                return 0
+
+            if not force:
+                raise ValueError(
+                        f'{release} is already dowloaded at {release_dir}')
+
+        # only the lock holder writes it, so a partial one can be resumed
+        temp_zip_filepath = os.path.join(default_download_dir(),
+                                         release + '.zip.part')
+
+        pinned_filepath = os.path.join(default_download_dir(),
+                                       release + '.sha256')
+
+        if sha256 is None:
+            sha256 = RELEASES_SHA256.get(release)
+
+        if sha256 is None:
+            sha256 = _read_pinned_sha256(pinned_filepath)
+
+        if sha256 is None:
+            warnings.warn('No SHA-256 known for {}; pinning the one of this '
+                          'download in {}.'.format(release, pinned_filepath),
+                          stacklevel=2)
+
+        transferred = 0
+
+        for attempt in range(retries + 1):
+
+            try:
+                transferred += fetch(RELEASES_URLS[release],
+                                     temp_zip_filepath, chunk_size, progress,
+                                     connections, sha256)
+                break
+            except HTTPError:
+                raise
+            except (IOError, http.client.HTTPException) as error:
+                # what the failed attempt wrote is kept and resumed
+                transferred += getattr(error, 'transferred', 0)
+
+                if attempt == retries:
+                    # every attempt's bytes, for download_all
+                    error.transferred = transferred
+                    raise
+
+        if sha256 is None:
+            _check_zip(temp_zip_filepath)
+            _pin_sha256(pinned_filepath, _hash_file(temp_zip_filepath))
+
+        staging_dir = tempfile.mkdtemp(prefix='.{}.'.format(release),
+                                       dir=default_download_dir())
+
+        try:
 
-    if os.path.isdir(release_dir):
+            if extract:
+                with zipfile.ZipFile(temp_zip_filepath, 'r') as zip_ref:
+                    zip_ref.extractall(staging_dir)
+
+            # move the old copy aside, so the new one replaces it in a
+            # single rename; it is deleted with the staging directory
+            if os.path.isdir(release_dir):
+                os.rename(release_dir, os.path.join(staging_dir, 'old'))
+            if os.path.isfile(release_zip):
+                os.replace(release_zip, os.path.join(staging_dir, 'old.zip'))
+
+            if extract:
+                os.rename(os.path.join(staging_dir, release), release_dir)
+                os.remove(temp_zip_filepath)
+            else:
+                os.replace(temp_zip_filepath, release_zip)
+
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    return transferred
+
+
+@contextmanager
+def release_lock(release):
+    """Holds an exclusive lock on <release>.lock in the download directory,
+    waiting for other processes that hold it."""
+
+    with open(get_release_dir(release) + '.lock', 'a+b') as f:
+
+        if sys.platform == 'win32':
+
+            f.seek(0)
+
+            while True:
+                try:
+                    # blocks for up to 10 seconds per try
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
 
-        if force:
-            shutil.rmtree(release_dir)
         else:
-            raise ValueError(f'{release} is already dowloaded at {release_dir}')
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+        try:
+            yield
+
+        finally:
+
+            if sys.platform == 'win32':
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def is_downloaded(release):
+    """Tells whether a release is in the download directory, extracted or
+    as a zip."""
+
+    return (os.path.isdir(get_release_dir(release)) or
+            os.path.isfile(get_release_zip(release)))
+
+
+def download_all(releases=None, max_concurrency=4, force=False, **kwargs):
+    """Downloads several releases at once, all of them by default.
+
+    Up to max_concurrency releases are fetched and extracted in parallel,
+    sharing a ConnectionPool. Other keyword arguments go to download.
+    Unless force=True, releases already downloaded are skipped.
+
+    Returns a DOWNLOAD_STATS per release, 0 bytes for skipped ones. A
+    failed download does not stop the others: its error is in the error
+    field of its stats.
+    """
+
+    if releases is None:
+        releases = list(RELEASES_URLS)
+
+    connections = ConnectionPool()
+
+    def timed_download(release):
+
+        if not force and is_downloaded(release):
+            return DOWNLOAD_STATS(0, 0.0, None)
+
+        start = time.perf_counter()
+
+        try:
+            transferred = download(release, force=force,
+                                   connections=connections, **kwargs)
+        except Exception as error:
+            return DOWNLOAD_STATS(getattr(error, 'transferred', 0),
+                                  time.perf_counter() - start, None, error)
+
+        seconds = time.perf_counter() - start
 
-    temp_zip_filepath = os.path.join(default_download_dir(), 'temp')
+        return DOWNLOAD_STATS(transferred, seconds,
+                              transferred / seconds if seconds else None)
 
-    request.urlretrieve(RELEASES_URLS[release], temp_zip_filepath)
+    try:
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
 
-    with zipfile.ZipFile(temp_zip_filepath, 'r') as zip_ref:
+            futures = {release: executor.submit(timed_download, release)
+                       for release in releases}
 
-        zip_ref.extractall(default_download_dir())
+    finally:
+        connections.close()
 
-    os.remove(temp_zip_filepath)
+    return {release: future.result() for release, future in futures.items()}
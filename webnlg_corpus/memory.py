@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import pickle
+import sys
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+
+def deep_sizeof(obj, seen=None):
+    """Returns the bytes used by obj and everything it refers to.
+
+    seen maps the ids of the objects already counted to the objects, which
+    it keeps alive so their ids are not reused; sharing one seen dict
+    between calls counts shared objects (interned strings, say) only once.
+    Classes are never counted.
+    """
+
+    if seen is None:
+        seen = {}
+
+    size = 0
+    stack = [obj]
+
+    while stack:
+
+        obj = stack.pop()
+
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+
+        seen[id(obj)] = obj
+
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            size += int(obj.memory_usage(index=True, deep=True).sum())
+            continue
+
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, np.ndarray):
+
+            # views do not own their data, the array they come from does
+            if obj.base is not None:
+                stack.append(obj.base)
+
+            if obj.dtype == object:
+                stack.extend(obj.ravel())
+
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+
+        elif isinstance(obj, (str, bytes, int, float)):
+            pass
+
+        else:
+
+            for cls in type(obj).__mro__:
+                for name in getattr(cls, '__slots__', ()):
+                    if hasattr(obj, name):
+                        stack.append(getattr(obj, name))
+
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+
+    return size
+
+
+def traced_sizeof(obj):
+    """Returns the bytes tracemalloc sees allocated when a copy of obj is
+    built from its pickle, a check on deep_sizeof that does not depend on
+    sys.getsizeof."""
+
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    tracing = tracemalloc.is_tracing()
+
+    if not tracing:
+        tracemalloc.start()
+
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        copy = pickle.loads(data)
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+    del copy
+
+    return after - before
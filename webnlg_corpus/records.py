@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+
+class Record(object):
+    """Base of the slotted records that replace the parser's dicts.
+
+    Records can still be read like those dicts: record['text'],
+    record.get('template', '') and 'entity_map' in record work as before,
+    with a field set to None counting as absent.
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+
+        if key not in self.__slots__:
+            raise KeyError(key)
+
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+
+        value = getattr(self, key, None) if key in self.__slots__ else None
+
+        return default if value is None else value
+
+    def __contains__(self, key):
+
+        return self.get(key) is not None
+
+    def keys(self):
+
+        return [key for key in self.__slots__ if key in self]
+
+    def items(self):
+
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def to_dict(self):
+
+        return dict(self.items())
+
+    def __eq__(self, other):
+
+        return (type(self) is type(other) and
+                all(getattr(self, key) == getattr(other, key)
+                    for key in self.__slots__))
+
+    def __ne__(self, other):
+
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+
+        return '{}({})'.format(type(self).__name__, ', '.join(
+                '{}={!r}'.format(key, value) for key, value in self.items()))
+
+
+class Triple(Record):
+
+    __slots__ = ('text', 'subject', 'predicate', 'object')
+
+    def __init__(self, text=None, subject=None, predicate=None, object=None):
+
+        self.text = text
+        self.subject = subject
+        self.predicate = predicate
+        self.object = object
+
+
+class Lex(Record):
+
+    __slots__ = ('text', 'template', 'comment', 'lid')
+
+    def __init__(self, text=None, template=None, comment=None, lid=None):
+
+        self.text = text
+        self.template = template
+        self.comment = comment
+        self.lid = lid
+
+
+class Entry(Record):
+
+    __slots__ = ('dataset', 'idx', 'category', 'eid', 'ntriples', 'content',
+                 'otriples', 'mtriples', 'lexes', 'entity_map',
+                 'delexicalized_mtriples')
+
+    def __init__(self, dataset, idx, category, eid, ntriples, content,
+                 otriples, mtriples, lexes, entity_map=None,
+                 delexicalized_mtriples=None):
+
+        self.dataset = dataset
+        self.idx = idx
+        self.category = category
+        self.eid = eid
+        self.ntriples = ntriples
+        self.content = content
+        self.otriples = otriples
+        self.mtriples = mtriples
+        self.lexes = lexes
+        self.entity_map = entity_map
+        self.delexicalized_mtriples = delexicalized_mtriples
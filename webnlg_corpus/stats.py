@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import time
+from contextlib import contextmanager
+
+
+class FileStats(object):
+    """What loading one XML file cost.
+
+    parse_seconds is spent in the XML parser, build_seconds turning parsed
+    elements into records and insert_seconds adding them to the storage.
+    allocated_blocks is the change in sys.getallocatedblocks() over the
+    file, roughly the number of objects it left alive.
+    """
+
+    __slots__ = ('dataset', 'filepath', 'entries', 'bytes_read',
+                 'parse_seconds', 'build_seconds', 'insert_seconds',
+                 'allocated_blocks')
+
+    def __init__(self, dataset, filepath):
+
+        self.dataset = dataset
+        self.filepath = filepath
+        self.entries = 0
+        self.bytes_read = 0
+        self.parse_seconds = 0.0
+        self.build_seconds = 0.0
+        self.insert_seconds = 0.0
+        self.allocated_blocks = 0
+
+    @property
+    def seconds(self):
+
+        return self.parse_seconds + self.build_seconds + self.insert_seconds
+
+    def __repr__(self):
+
+        return ('FileStats({!r}, entries={}, bytes_read={}, '
+                'seconds={:.6f})'.format(self.filepath, self.entries,
+                                         self.bytes_read, self.seconds))
+
+
+class LoadStats(object):
+    """What a load spent its time on.
+
+    phases maps each phase (list_files, read_snapshot, parse, build,
+    insert, write_snapshot) to its wall time in seconds; files holds a
+    FileStats per parsed file, in load order. With parallel workers parse
+    and build add up the time of every worker.
+    """
+
+    def __init__(self):
+
+        self.phases = {}
+        self.files = []
+        self.seconds = 0.0
+        self.from_snapshot = False
+
+    @contextmanager
+    def phase(self, name):
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_file(self, file_stats):
+
+        self.files.append(file_stats)
+
+        self.add('parse', file_stats.parse_seconds)
+        self.add('build', file_stats.build_seconds)
+        self.add('insert', file_stats.insert_seconds)
+
+    @property
+    def entries(self):
+
+        return sum(file_stats.entries for file_stats in self.files)
+
+    @property
+    def bytes_read(self):
+
+        return sum(file_stats.bytes_read for file_stats in self.files)
+
+    @property
+    def allocated_blocks(self):
+
+        return sum(file_stats.allocated_blocks for file_stats in self.files)
+
+    def as_dict(self):
+
+        return {
+            'seconds': self.seconds,
+            'from_snapshot': self.from_snapshot,
+            'phases': dict(self.phases),
+            'entries': self.entries,
+            'bytes_read': self.bytes_read,
+            'allocated_blocks': self.allocated_blocks,
+            'files': [
+                {key: getattr(file_stats, key)
+                 for key in FileStats.__slots__ + ('seconds',)}
+                for file_stats in self.files
+            ]
+        }
+
+    def __repr__(self):
+
+        return 'LoadStats(seconds={:.6f}, entries={}, phases={})'.format(
+                self.seconds, self.entries,
+                {k: round(v, 6) for k, v in self.phases.items()})
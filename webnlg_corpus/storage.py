@@ -0,0 +1,699 @@
+# -*- coding: utf-8 -*-
+import os
+from array import array
+import numpy as np
+from collections import defaultdict
+from .records import Entry, Lex, Triple
+from .downloader import open_dataset_file
+from .memory import deep_sizeof
+
+
+class EntryContent(object):
+    """Raw XML of an entry, read from its source file on demand."""
+
+    __slots__ = ('filepath', 'start', 'end')
+
+    def __init__(self, filepath, start, end):
+
+        self.filepath = filepath
+        self.start = start
+        self.end = end
+
+    def read(self):
+
+        with open_dataset_file(self.filepath) as f:
+
+            f.seek(self.start)
+
+            return f.read(self.end - self.start)
+
+    def __bytes__(self):
+
+        return self.read()
+
+    def __eq__(self, other):
+
+        return (isinstance(other, EntryContent) and
+                (self.filepath, self.start, self.end) ==
+                (other.filepath, other.start, other.end))
+
+    def __hash__(self):
+
+        return hash((self.filepath, self.start, self.end))
+
+    def __repr__(self):
+
+        return 'EntryContent({!r}, {}, {})'.format(self.filepath,
+                                                   self.start, self.end)
+
+
+class SymbolTable(object):
+    """Gives each distinct string a small integer code.
+
+    Strings that repeat across the corpus (datasets, categories, triple
+    parts, lex comments) are stored once here and as codes in the columns.
+    """
+
+    def __init__(self):
+
+        self.strings = []
+        self.codes = {}
+
+    def encode(self, string):
+
+        code = self.codes.get(string)
+
+        if code is None:
+            code = self.codes[string] = len(self.strings)
+            self.strings.append(string)
+
+        return code
+
+    def decode(self, code):
+
+        return self.strings[code]
+
+    def decode_many(self, codes):
+        """Decodes an array of codes into an object array of strings."""
+
+        strings = np.empty(len(self.strings), dtype=object)
+        strings[:] = self.strings
+
+        return strings[codes]
+
+    def lookup(self, strings):
+        """Returns the codes of the known strings among strings."""
+
+        return {self.codes[s] for s in strings if s in self.codes}
+
+    def __len__(self):
+
+        return len(self.strings)
+
+
+class ChildTable(object):
+    """Rows owned by entries, stored column-wise.
+
+    The children of entry i are the rows in [offsets[i], offsets[i + 1]).
+    Rows are rebuilt as instances of record, a Record class. Encoded
+    columns hold codes from a SymbolTable instead of strings.
+    """
+
+    def __init__(self, record, columns, encoded=(), symbols=None):
+
+        self.record = record
+        self.encoded = frozenset(encoded)
+        self.symbols = symbols
+        self.columns = {
+                column: array('i') if column in self.encoded else []
+                for column in columns
+        }
+        self.offsets = array('q', [0])
+
+    def append(self, rows):
+
+        for row in rows:
+            for column, values in self.columns.items():
+
+                value = getattr(row, column)
+
+                if column in self.encoded:
+                    value = self.symbols.encode(value)
+
+                values.append(value)
+
+        self.offsets.append(self.offsets[-1] + len(rows))
+
+    def span(self, i):
+
+        return self.offsets[i], self.offsets[i + 1]
+
+    def rows(self, i):
+
+        start, end = self.span(i)
+
+        strings = self.symbols.strings if self.symbols else None
+
+        columns = [
+            [strings[code] for code in values[start:end]]
+            if column in self.encoded else values[start:end]
+            for column, values in self.columns.items()
+        ]
+
+        return [self.record(*values) for values in zip(*columns)]
+
+    def locate(self, rows):
+        """Returns, for the children of the entries at rows, the position
+        of their entry and their own position in the table."""
+
+        offsets = np.array(self.offsets, dtype=np.int64)
+
+        starts = offsets[rows]
+        counts = offsets[rows + 1] - starts
+
+        owners = np.repeat(rows, counts)
+        # position of each child within its own entry
+        ranks = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) -
+                                                    counts, counts)
+
+        return owners, np.repeat(starts, counts) + ranks
+
+    def __len__(self):
+
+        return self.offsets[-1]
+
+
+class ColumnarStorage(object):
+    """In-memory entry store.
+
+    Entry fields are kept in parallel columns, one value per entry, and
+    triples and lexes in child tables indexed by entry position. Datasets,
+    categories, triple parts and lex comments are dictionary encoded
+    through a single SymbolTable, so filters on them compare integers.
+    """
+
+    def __init__(self, release_dir=None):
+
+        self.symbols = SymbolTable()
+
+        self.dataset = array('i')
+        self.category = array('i')
+        self.eid = []
+        self.ntriples = array('i')
+        self.idx = []
+        # raw XML of each entry as a byte range of one of the source files;
+        # files are kept relative to release_dir, which snapshots leave out
+        # so that the data dir can be moved
+        self.release_dir = release_dir
+        self.files = []
+        self.file_positions = {}
+        self.content_file = array('i')
+        self.content_start = array('q')
+        self.content_end = array('q')
+        # None for entries from files without entity maps
+        self.entity_map = []
+        # idx -> entry position
+        self.positions = {}
+        # NumPy copies of the array columns, dropped on insert
+        self._arrays = {}
+        # column -> {value: sorted positions}, dropped on insert
+        self._groups = {}
+
+        triple_columns = ['text', 'subject', 'predicate', 'object']
+
+        self.otriples = ChildTable(Triple, triple_columns,
+                                   encoded=triple_columns,
+                                   symbols=self.symbols)
+        self.mtriples = ChildTable(Triple, triple_columns,
+                                   encoded=triple_columns,
+                                   symbols=self.symbols)
+        self.delexicalized_mtriples = ChildTable(Triple, triple_columns,
+                                                 encoded=triple_columns,
+                                                 symbols=self.symbols)
+        self.lexes = ChildTable(Lex, ['text', 'template', 'comment', 'lid'],
+                                encoded=['comment'],
+                                symbols=self.symbols)
+
+    def insert(self, entry):
+
+        self.positions[entry.idx] = len(self)
+        self._arrays.clear()
+        self._groups.clear()
+
+        self.dataset.append(self.symbols.encode(entry.dataset))
+        self.category.append(self.symbols.encode(entry.category))
+        self.eid.append(entry.eid)
+        self.ntriples.append(entry.ntriples)
+        self.idx.append(entry.idx)
+
+        content = entry.content
+        filepath = self.relpath(content.filepath)
+
+        if filepath not in self.file_positions:
+            self.file_positions[filepath] = len(self.files)
+            self.files.append(filepath)
+
+        self.content_file.append(self.file_positions[filepath])
+        self.content_start.append(content.start)
+        self.content_end.append(content.end)
+        self.entity_map.append(entry.entity_map)
+
+        self.otriples.append(entry.otriples)
+        self.mtriples.append(entry.mtriples)
+        self.delexicalized_mtriples.append(
+                entry.delexicalized_mtriples or [])
+        self.lexes.append(entry.lexes)
+
+    def insert_multiple(self, entries):
+
+        for entry in entries:
+            self.insert(entry)
+
+    def extend(self, other):
+        """Appends the entries of another store, typically one a worker
+        process filled from a single file.
+
+        The columns are copied as whole arrays, with the symbol codes and
+        file positions of other mapped to those of this store; both stores
+        must keep their files relative to the same release_dir.
+        """
+
+        base = len(self)
+
+        self._arrays.clear()
+        self._groups.clear()
+
+        codes = np.array([self.symbols.encode(string)
+                          for string in other.symbols.strings] or [0],
+                         dtype=np.int32)
+
+        def remap(values, mapping):
+
+            return array(values.typecode, mapping[
+                    np.frombuffer(values, dtype=np.int32)].tobytes())
+
+        file_positions = []
+
+        for filepath in other.files:
+
+            if filepath not in self.file_positions:
+                self.file_positions[filepath] = len(self.files)
+                self.files.append(filepath)
+
+            file_positions.append(self.file_positions[filepath])
+
+        self.dataset.extend(remap(other.dataset, codes))
+        self.category.extend(remap(other.category, codes))
+        self.eid.extend(other.eid)
+        self.ntriples.extend(other.ntriples)
+        self.idx.extend(other.idx)
+        self.content_file.extend(remap(
+                other.content_file,
+                np.array(file_positions or [0], dtype=np.int32)))
+        self.content_start.extend(other.content_start)
+        self.content_end.extend(other.content_end)
+        self.entity_map.extend(other.entity_map)
+
+        for idx, position in other.positions.items():
+            self.positions[idx] = base + position
+
+        for name in ('otriples', 'mtriples', 'delexicalized_mtriples',
+                     'lexes'):
+
+            table = getattr(self, name)
+            other_table = getattr(other, name)
+
+            for column, values in table.columns.items():
+
+                other_values = other_table.columns[column]
+
+                if column in table.encoded:
+                    values.extend(remap(other_values, codes))
+                else:
+                    values.extend(other_values)
+
+            offset = table.offsets[-1]
+            table.offsets.extend(
+                    array('q', (np.frombuffer(other_table.offsets[1:],
+                                              dtype=np.int64) +
+                                offset).tobytes()))
+
+    def take(self, rows):
+        """Returns a new store holding only the entries at rows, in that
+        order, with only the symbols and files they use."""
+
+        rows = np.asarray(rows, dtype=np.int64)
+        db = ColumnarStorage(self.release_dir)
+
+        tables = ['otriples', 'mtriples', 'delexicalized_mtriples', 'lexes']
+        children = {name: getattr(self, name).locate(rows)[1]
+                    for name in tables}
+
+        def codes(values, index):
+
+            return np.array(values, dtype=np.int32)[index]
+
+        # every column of symbol codes, cut down to the entries kept
+        encoded = {('', 'dataset'): codes(self.dataset, rows),
+                   ('', 'category'): codes(self.category, rows)}
+
+        for name in tables:
+
+            table = getattr(self, name)
+
+            for column in table.encoded:
+                encoded[name, column] = codes(table.columns[column],
+                                              children[name])
+
+        used = np.unique(np.concatenate(list(encoded.values()) +
+                                        [np.array([], dtype=np.int32)]))
+        mapping = np.zeros(len(self.symbols), dtype=np.int32)
+        mapping[used] = np.arange(len(used), dtype=np.int32)
+
+        for code in used.tolist():
+            db.symbols.encode(self.symbols.strings[code])
+
+        def take_codes(key):
+
+            return array('i', mapping[encoded[key]].tobytes())
+
+        content_file = codes(self.content_file, rows)
+        files = np.unique(content_file)
+        file_mapping = np.zeros(len(self.files), dtype=np.int32)
+        file_mapping[files] = np.arange(len(files), dtype=np.int32)
+
+        db.files = [self.files[i] for i in files.tolist()]
+        db.file_positions = {filepath: i for i, filepath in enumerate(db.files)}
+
+        rows_list = rows.tolist()
+
+        db.dataset = take_codes(('', 'dataset'))
+        db.category = take_codes(('', 'category'))
+        db.eid = [self.eid[i] for i in rows_list]
+        db.ntriples = array('i', [self.ntriples[i] for i in rows_list])
+        db.idx = [self.idx[i] for i in rows_list]
+        db.content_file = array('i', file_mapping[content_file].tobytes())
+        db.content_start = array('q', [self.content_start[i]
+                                       for i in rows_list])
+        db.content_end = array('q', [self.content_end[i] for i in rows_list])
+        db.entity_map = [self.entity_map[i] for i in rows_list]
+        db.positions = {idx: i for i, idx in enumerate(db.idx)}
+
+        for name in tables:
+
+            table = getattr(self, name)
+            new_table = getattr(db, name)
+            index = children[name].tolist()
+
+            for column, values in table.columns.items():
+
+                if column in table.encoded:
+                    new_table.columns[column] = take_codes((name, column))
+                else:
+                    new_table.columns[column] = [values[j] for j in index]
+
+            offsets = np.array(table.offsets, dtype=np.int64)
+            counts = offsets[rows + 1] - offsets[rows]
+
+            new_table.offsets = array('q', np.concatenate(
+                    [[0], np.cumsum(counts)]).astype(np.int64).tobytes())
+
+        return db
+
+    def entry(self, i):
+        """Rebuilds entry i as the Entry record the parser produced."""
+
+        entry = Entry(
+            dataset=self.symbols.strings[self.dataset[i]],
+            idx=self.idx[i],
+            category=self.symbols.strings[self.category[i]],
+            eid=self.eid[i],
+            ntriples=self.ntriples[i],
+            content=self.content(i),
+            otriples=self.otriples.rows(i),
+            mtriples=self.mtriples.rows(i),
+            lexes=self.lexes.rows(i)
+        )
+
+        if self.entity_map[i] is not None:
+
+            entry.entity_map = self.entity_map[i]
+            entry.delexicalized_mtriples = \
+                self.delexicalized_mtriples.rows(i)
+
+        return entry
+
+    def relpath(self, filepath):
+        """Returns filepath as stored in the file table."""
+
+        if self.release_dir is None:
+            return filepath
+
+        return os.path.relpath(filepath, self.release_dir)
+
+    def filepath(self, file_position):
+        """Returns the path of a file of the file table."""
+
+        filepath = self.files[file_position]
+
+        if self.release_dir is None:
+            return filepath
+
+        # normalized, since a release zip is a sibling of release_dir
+        return os.path.normpath(os.path.join(self.release_dir, filepath))
+
+    def content(self, i):
+
+        return EntryContent(self.filepath(self.content_file[i]),
+                            self.content_start[i],
+                            self.content_end[i])
+
+    def contents(self, indexes):
+        """Returns the EntryContent of several entries, without reading
+        them."""
+
+        filepaths = [self.filepath(file_position)
+                     for file_position in range(len(self.files))]
+
+        return [EntryContent(filepaths[self.content_file[i]],
+                             self.content_start[i],
+                             self.content_end[i])
+                for i in indexes]
+
+    def read_contents(self, indexes):
+        """Reads the raw XML of several entries, opening each source file
+        once."""
+
+        by_file = defaultdict(list)
+
+        for i in indexes:
+            by_file[self.content_file[i]].append(i)
+
+        contents = {}
+
+        for file_position, file_indexes in by_file.items():
+
+            with open_dataset_file(self.filepath(file_position)) as f:
+
+                for i in sorted(file_indexes,
+                                key=self.content_start.__getitem__):
+
+                    f.seek(self.content_start[i])
+                    contents[i] = f.read(self.content_end[i] -
+                                         self.content_start[i])
+
+        return [contents[i] for i in indexes]
+
+    def position(self, idx):
+        """Returns the position of the entry with the given idx, or None."""
+
+        return self.positions.get(idx)
+
+    def positions_of(self, idxs):
+        """Returns the positions of several idxs as an int array, -1 for
+        unknown ones."""
+
+        get = self.positions.get
+
+        return np.fromiter((get(idx, -1) for idx in idxs), dtype=np.int64)
+
+    def column(self, name):
+        """Returns one of the columns as a NumPy array; list columns, like
+        idx and eid, become object arrays."""
+
+        values = self._arrays.get(name)
+
+        if values is None:
+
+            values = getattr(self, name)
+            values = self._arrays[name] = np.array(
+                    values, dtype=object if isinstance(values, list) else None)
+
+        return values
+
+    def children(self, table, column, rows):
+        """Returns the values of one column of a child table ("otriples",
+        "mtriples", "delexicalized_mtriples" or "lexes") for the children
+        of the entries at rows, in the order of rows, with the number of
+        children of each entry.
+
+        Encoded columns are decoded, so values is an object array of the
+        column values either way.
+        """
+
+        name = table
+        table = getattr(self, name)
+
+        offsets = self._arrays.get(name + '.offsets')
+
+        if offsets is None:
+            offsets = self._arrays[name + '.offsets'] = np.array(
+                    table.offsets, dtype=np.int64)
+
+        values = self._arrays.get(name + '.' + column)
+
+        if values is None:
+
+            values = table.columns[column]
+
+            if column in table.encoded:
+                values = self.strings()[np.array(values, dtype=np.int64)]
+            else:
+                values = np.array(values, dtype=object)
+
+            self._arrays[name + '.' + column] = values
+
+        starts = offsets[rows]
+        counts = offsets[rows + 1] - starts
+        ends = np.cumsum(counts)
+
+        children = (np.repeat(starts - ends + counts, counts) +
+                    np.arange(ends[-1] if len(ends) else 0))
+
+        return values[children], counts
+
+    def strings(self):
+        """Returns the symbol strings as an object array, indexable by
+        code."""
+
+        strings = self._arrays.get('symbols')
+
+        if strings is None:
+            strings = self._arrays['symbols'] = np.empty(len(self.symbols),
+                                                         dtype=object)
+            strings[:] = self.symbols.strings
+
+        return strings
+
+    def groups(self, name):
+        """Groups the entries by the value of one of the array columns.
+
+        Returns a dict from each value (a symbol code for dataset and
+        category) to the sorted positions of the entries that have it.
+        """
+
+        groups = self._groups.get(name)
+
+        if groups is None:
+
+            values = self.column(name)
+            order = np.argsort(values, kind='stable')
+            keys, starts = np.unique(values[order], return_index=True)
+
+            groups = self._groups[name] = {
+                int(key): positions
+                for key, positions in zip(keys, np.split(order, starts[1:]))
+            }
+
+        return groups
+
+    def select(self, name, values, rows=None):
+        """Returns the positions, among rows if given, of the entries whose
+        name column holds one of values."""
+
+        groups = self.groups(name)
+        matches = [groups[value] for value in values if value in groups]
+
+        if not matches:
+            return np.array([], dtype=np.int64)
+
+        selected = np.sort(np.concatenate(matches))
+
+        if rows is None or len(rows) == len(self):
+            return selected
+
+        return np.intersect1d(rows, selected, assume_unique=True)
+
+    def search_files(self, filepaths):
+        """Returns the positions of the entries read from filepaths, or
+        None if any of them is not in the file table."""
+
+        filepaths = [self.relpath(filepath) for filepath in filepaths]
+
+        if not all(filepath in self.file_positions for filepath in filepaths):
+            return None
+
+        file_positions = [self.file_positions[filepath]
+                          for filepath in filepaths]
+
+        return np.flatnonzero(np.isin(self.column('content_file'),
+                                      file_positions))
+
+    def search(self, rows=None, ntriples=None, categories=None,
+               datasets=None, eid=None, idx=None):
+        """Returns the positions of the entries that match every given
+        filter, in insertion order.
+
+        rows, a sorted array of positions, restricts the search to those
+        entries.
+        """
+
+        if ntriples:
+            rows = self.select('ntriples', ntriples, rows)
+
+        if categories:
+            rows = self.select('category', self.symbols.lookup(categories),
+                               rows)
+
+        if datasets:
+            rows = self.select('dataset', self.symbols.lookup(datasets), rows)
+
+        if rows is None:
+            rows = np.arange(len(self))
+
+        if idx:
+            rows = rows[rows == self.positions.get(idx, -1)]
+
+        if eid:
+            rows = rows[np.fromiter((self.eid[i] == eid for i in rows),
+                                    dtype=bool, count=len(rows))]
+
+        return rows
+
+    def memory_usage(self, seen=None):
+        """Returns the bytes used by each part of the store, as a dict.
+
+        Strings shared between parts are counted in the first part that
+        holds them, symbols first.
+        """
+
+        if seen is None:
+            seen = {}
+
+        def table_sizeof(*tables):
+
+            return sum(deep_sizeof((table.columns, table.offsets), seen)
+                       for table in tables)
+
+        return {
+            'symbols': deep_sizeof(self.symbols.__dict__, seen),
+            'entries': deep_sizeof((self.dataset, self.category, self.eid,
+                                    self.ntriples, self.idx,
+                                    self.entity_map), seen),
+            'triples': table_sizeof(self.otriples, self.mtriples,
+                                    self.delexicalized_mtriples),
+            'lexes': table_sizeof(self.lexes),
+            'content': deep_sizeof((self.files, self.file_positions,
+                                    self.content_file, self.content_start,
+                                    self.content_end), seen),
+            'indexes': deep_sizeof((self.positions, self._arrays,
+                                    self._groups), seen)
+        }
+
+    def __len__(self):
+
+        return len(self.idx)
+
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        state['_arrays'] = {}
+        state['_groups'] = {}
+        state['release_dir'] = None
+
+        return state
+
+    def __iter__(self):
+
+        for i in range(len(self)):
+            yield self.entry(i)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""Writes synthetic WebNLG releases, for scale tests and benchmarks.
+
+The files follow the layout and XML schema of the real releases, so load,
+iter_entries and the rest read them like a downloaded release:
+
+    python -m webnlg_corpus.synthetic release_v2 100000 --data /tmp/webnlg_data
+"""
+import argparse
+import os
+import shutil
+from collections import Counter
+from random import Random
+from xml.sax.saxutils import escape, quoteattr
+from .downloader import default_download_dir
+
+
+CATEGORIES = ['Airport', 'Astronaut', 'Building', 'City', 'ComicsCharacter',
+              'Food', 'Monument', 'SportsTeam', 'University', 'WrittenWork',
+              'Athlete', 'Artist', 'CelestialBody', 'MeanOfTransportation',
+              'Politician']
+
+DATASETS = {'train': 0.8, 'dev': 0.1, 'test': 0.1}
+
+# roughly the shape of release_v2
+NTRIPLES = {1: 0.22, 2: 0.21, 3: 0.2, 4: 0.17, 5: 0.12, 6: 0.05, 7: 0.03}
+
+# distinct subjects, predicates and objects drawn from per category
+ENTITIES_PER_CATEGORY = 200
+PREDICATES_PER_CATEGORY = 40
+
+# draws are counted this many at a time, to bound memory for huge releases
+COUNT_CHUNK = 1 << 20
+
+
+def generate_release(release, n_entries, v12=False, datasets=None,
+                     categories=None, ntriples=None, lexes=(1, 3), seed=0,
+                     download_dir=None, overwrite=False):
+    """Writes a release of n_entries random entries and returns its dir.
+
+    datasets, categories and ntriples map each value to its relative
+    weight (categories may also be a list, weighted evenly); lexes is the
+    range of lexicalisations per entry. With v12=True the files are the
+    v1.2 variant, with templates and entity maps.
+
+    An existing release dir is an error, unless overwrite=True, which
+    deletes it first so no file of an earlier run is left behind.
+    """
+
+    if download_dir is None:
+        download_dir = default_download_dir()
+
+    if categories is None:
+        categories = CATEGORIES
+    if not isinstance(categories, dict):
+        categories = dict.fromkeys(categories, 1)
+
+    datasets = datasets or DATASETS
+    ntriples = ntriples or NTRIPLES
+
+    rg = Random(seed)
+
+    release_dir = os.path.join(download_dir, release)
+
+    if os.path.exists(release_dir):
+
+        if not overwrite:
+            raise ValueError('{} already exists; pass overwrite=True to '
+                             'replace it.'.format(release_dir))
+
+        shutil.rmtree(release_dir)
+
+    files = [(dataset, category, size)
+             for dataset in datasets
+             for category in categories
+             for size in ntriples]
+    weights = [datasets[dataset] * categories[category] * ntriples[size]
+               for dataset, category, size in files]
+
+    counts = Counter()
+
+    for start in range(0, n_entries, COUNT_CHUNK):
+        k = min(COUNT_CHUNK, n_entries - start)
+        counts.update(rg.choices(range(len(files)), weights, k=k))
+
+    for position, (dataset, category, size) in enumerate(files):
+
+        if not counts[position]:
+            continue
+
+        dirpath = os.path.join(release_dir, dataset,
+                               '{}triples'.format(size))
+        os.makedirs(dirpath, exist_ok=True)
+
+        filename = category + ('.v1.2.xml' if v12 else '.xml')
+
+        with open(os.path.join(dirpath, filename), 'w',
+                  encoding='utf-8') as f:
+
+            f.write('<?xml version="1.0" ?>\n<benchmark>\n  <entries>\n')
+
+            for eid in range(1, counts[position] + 1):
+                f.write(make_entry_xml(rg, category, eid, size, v12, lexes))
+
+            f.write('  </entries>\n</benchmark>\n')
+
+    return release_dir
+
+
+def make_triples(rg, category, size):
+
+    subject = '{}_{}'.format(category, rg.randrange(ENTITIES_PER_CATEGORY))
+
+    triples = []
+
+    for _ in range(size):
+
+        predicate = 'property{}'.format(rg.randrange(PREDICATES_PER_CATEGORY))
+
+        if rg.random() < 0.5:
+            value = 'Entity_{}'.format(rg.randrange(ENTITIES_PER_CATEGORY))
+        else:
+            value = '"literal value {}"'.format(
+                    rg.randrange(ENTITIES_PER_CATEGORY))
+
+        triples.append((subject, predicate, value))
+
+        # later triples may describe the object, as in WebNLG trees
+        if not value.startswith('"') and rg.random() < 0.3:
+            subject = value
+
+    return triples
+
+
+def make_entry_xml(rg, category, eid, size, v12, lexes):
+
+    triples = make_triples(rg, category, size)
+
+    # the first subject is the agent, every other entity a patient
+    entities = {}
+    for subject, _, value in triples:
+        for entity in (subject, value):
+            if entity not in entities:
+                entities[entity] = 'PATIENT-{}'.format(len(entities))
+    entities[triples[0][0]] = 'AGENT-1'
+
+    lines = ['    <entry category={} eid="Id{}" size="{}">'.format(
+             quoteattr(category), eid, size)]
+
+    lines.append('      <originaltripleset>')
+    lines.extend(
+        '        <otriple>{}</otriple>'.format(escape(' | '.join(
+            (s, p, o + '@en' if o.startswith('"') else o))))
+        for s, p, o in triples
+    )
+    lines.append('      </originaltripleset>')
+
+    lines.append('      <modifiedtripleset>')
+    lines.extend('        <mtriple>{}</mtriple>'.format(escape(' | '.join(t)))
+                 for t in triples)
+    lines.append('      </modifiedtripleset>')
+
+    for lid in range(1, rg.randint(*lexes) + 1):
+
+        template = ' and '.join(
+            '{} {} {}'.format(entities[s], p, entities[o])
+            for s, p, o in triples) + ' .'
+        text = ' and '.join(
+            '{} {} {}'.format(s, p, o.strip('"'))
+            for s, p, o in triples) + ' .'
+
+        comment = 'good' if rg.random() < 0.9 else 'toFix'
+
+        if v12:
+            lines.append('      <lex comment="{}" lid="Id{}">'.format(
+                         comment, lid))
+            lines.append('        <text>{}</text>'.format(escape(text)))
+            lines.append('        <template>{}</template>'.format(
+                         escape(template)))
+            lines.append('      </lex>')
+        else:
+            lines.append('      <lex comment="{}" lid="Id{}">{}</lex>'.format(
+                         comment, lid, escape(text)))
+
+    if v12:
+        lines.append('      <entitymap>')
+        lines.extend(
+            '        <entity>{} | {}</entity>'.format(placeholder,
+                                                     escape(entity))
+            for entity, placeholder in entities.items()
+        )
+        lines.append('      </entitymap>')
+
+    lines.append('    </entry>\n')
+
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+            description='Writes a synthetic WebNLG release.')
+    parser.add_argument('release')
+    parser.add_argument('n_entries', type=int)
+    parser.add_argument('--v12', action='store_true',
+                        help='write the v1.2 variant, with entity maps')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data', help='download dir to write into')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='replace the release if it already exists')
+    args = parser.parse_args(argv)
+
+    print(generate_release(args.release, args.n_entries, v12=args.v12,
+                           seed=args.seed, download_dir=args.data,
+                           overwrite=args.overwrite))
+
+
+if __name__ == '__main__':
+
+    main()
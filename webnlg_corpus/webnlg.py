@@ -1,139 +1,647 @@
 import xml.etree.ElementTree as ET
+import importlib
+import os
+import re
+import sys
+import time
+from collections import deque
 from .config import RELEASES_URLS
-from tinydb import TinyDB, Query
-from tinydb.storages import MemoryStorage
 from random import Random
+import numpy as np
 import pandas as pd
 from collections import namedtuple
-from functools import reduce
-from operator import __and__
-from .downloader import get_release_datasets_dir, get_dataset_files
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from .downloader import (get_release_dir, get_release_datasets_dir,
+                         get_dataset_files, get_file_ntriples,
+                         get_dataset_file_size, open_dataset_file)
+from .storage import ColumnarStorage, EntryContent
+from .records import Entry, Lex, Triple
+from .stats import FileStats, LoadStats
+from .memory import deep_sizeof, traced_sizeof
+from .cache import (get_snapshot_filepath, snapshot_key, read_snapshot,
+                    write_snapshot)
 
 
 PANDAS_CONTAINER = namedtuple('PANDAS_CONTAINER', ['edf', 'odf', 'mdf', 'ldf'])
 
+ARROW_CONTAINER = namedtuple('ARROW_CONTAINER', ['edf', 'odf', 'mdf', 'ldf'])
+
+MEMORY_USAGE = namedtuple('MEMORY_USAGE',
+                          ['symbols', 'entries', 'triples', 'lexes',
+                           'content', 'indexes', 'frames', 'total',
+                           'traced'])
+
+# iter_batches fields, as (where, what): entry columns, entry columns of
+# symbol codes, and columns of the child tables
+BATCH_FIELDS = {
+    'idx': ('column', 'idx'),
+    'eid': ('column', 'eid'),
+    'ntriples': ('column', 'ntriples'),
+    'dataset': ('symbol', 'dataset'),
+    'category': ('symbol', 'category'),
+    'data': ('mtriples', 'text'),
+    'lexes': ('lexes', 'text'),
+    'templates': ('lexes', 'template'),
+}
+
+# columns the Arrow export is partitioned by, as dataset=.../category=...
+ARROW_PARTITIONING = ['dataset', 'category']
+
 TRIPLE_KEYS = ['subject', 'predicate', 'object']
 
+# bump whenever the parsed entries or their storage change shape, so that
+# snapshots written by older versions are not reused
+PARSER_VERSION = 9
+
+# bytes read from an XML file at a time while streaming it
+READ_SIZE = 1 << 16
+
+
+def load(release, workers=None, cache=True, datasets=None, categories=None,
+         ntriples=None, hook=None, shard=None):
+    """Loads a downloaded release into memory.
+
+    datasets, categories and ntriples restrict the load like subset does,
+    but files and entries that cannot match are skipped before parsing.
+
+    With workers > 1 the XML files are parsed by a pool of that many
+    processes, each sending back its file as the columns of a store of its
+    own, which are appended in file order; the result is the same as a
+    serial load.
+
+    With cache=True the parsed release is kept in a snapshot file next to
+    the release directory, and later loads read it instead of the XML as
+    long as neither the files nor PARSER_VERSION change. Only unfiltered
+    loads write the snapshot, but filtered loads also read it.
+
+    The returned corpus has a load_stats attribute, a LoadStats with the
+    time spent per phase and per file; hook, if given, is called with the
+    FileStats of each file as soon as it is loaded.
 
-def load(release):
+    shard, a (rank, world_size) pair, loads only the XML files that
+    shard_release_files assigns to rank, so that world_size processes
+    loading each its own rank parse every file of the release once. Like
+    filters, sharded loads read the snapshot but do not write it; a shard
+    read from the snapshot is copied out of it, so only while loading does
+    a rank hold the whole release.
+    """
 
     if release not in RELEASES_URLS:
         raise ValueError('{} not in in {}'.format(release,
                          list(RELEASES_URLS.keys())))
 
-    db = TinyDB(storage=MemoryStorage)
+    start = time.perf_counter()
+    load_stats = LoadStats()
+
+    filtered = bool(datasets or categories or ntriples)
+    sharded = shard is not None
+
+    db = ColumnarStorage(get_release_dir(release))
+
+    with load_stats.phase('list_files'):
+        dataset_names, filepaths = list_release_files(release)
+
+    if cache:
+
+        with load_stats.phase('read_snapshot'):
+
+            snapshot_filepath = get_snapshot_filepath(release)
+            key = snapshot_key(release, filepaths, PARSER_VERSION)
+
+            snapshot_db = read_snapshot(snapshot_filepath, key)
+
+        if snapshot_db is not None:
+            snapshot_db.release_dir = get_release_dir(release)
+
+        shard_rows = None
+
+        if snapshot_db is not None and sharded:
+
+            shard_rows = snapshot_db.search_files(
+                    shard_release_files(filepaths, *shard))
+
+            # the snapshot does not know every file of the shard (files
+            # without entries, for one): parse instead
+            if shard_rows is None:
+                snapshot_db = None
+
+        if snapshot_db is not None:
+
+            # a shard keeps a copy of its own entries only, so the ranks do
+            # not each hold the whole release
+            if shard_rows is not None:
+                snapshot_db = snapshot_db.take(shard_rows)
+
+            corpus = WebNLGCorpus(release, snapshot_db)
+
+            if filtered:
+                corpus = corpus.subset(ntriples=ntriples,
+                                       categories=categories,
+                                       datasets=datasets)
+
+            load_stats.from_snapshot = True
+            load_stats.seconds = time.perf_counter() - start
+            corpus.load_stats = load_stats
+
+            return corpus
+
+    if sharded or filtered:
+
+        with load_stats.phase('list_files'):
+
+            wanted = set(filepaths)
+
+            if sharded:
+                wanted = set(shard_release_files(filepaths, *shard))
+
+            if filtered:
+                dataset_names, filepaths = list_release_files(
+                        release, datasets, ntriples)
+
+            kept = [i for i, filepath in enumerate(filepaths)
+                    if filepath in wanted]
+
+            dataset_names = [dataset_names[i] for i in kept]
+            filepaths = [filepaths[i] for i in kept]
+
+    if workers is not None and workers > 1 and len(filepaths) > 1:
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+
+            for file_db, file_stats in executor.map(
+                    _read_webnlg_file_columns, repeat(db.release_dir),
+                    dataset_names, filepaths, repeat(categories),
+                    repeat(ntriples)):
+
+                insert_start = time.perf_counter()
+                db.extend(file_db)
+                file_stats.insert_seconds = time.perf_counter() - insert_start
+
+                load_stats.add_file(file_stats)
+
+                if hook is not None:
+                    hook(file_stats)
+
+    else:
+
+        for dataset_name, filepath in zip(dataset_names, filepaths):
+
+            file_stats = FileStats(dataset_name, filepath)
+            blocks = sys.getallocatedblocks()
+
+            entries = iter_webnlg_file(dataset_name, filepath, categories,
+                                       ntriples, file_stats)
+
+            # inserting consumes the stream, so the parse and build time
+            # are taken out of the insert time afterwards
+            insert_start = time.perf_counter()
+            db.insert_multiple(entries)
+            file_stats.insert_seconds = (time.perf_counter() - insert_start -
+                                         file_stats.parse_seconds -
+                                         file_stats.build_seconds)
+            file_stats.allocated_blocks = sys.getallocatedblocks() - blocks
+
+            load_stats.add_file(file_stats)
+
+            if hook is not None:
+                hook(file_stats)
+
+    if cache and not (filtered or sharded):
+        with load_stats.phase('write_snapshot'):
+            write_snapshot(snapshot_filepath, key, db)
+
+    corpus = WebNLGCorpus(release, db)
+
+    load_stats.seconds = time.perf_counter() - start
+    corpus.load_stats = load_stats
+
+    return corpus
+
+
+def list_release_files(release, datasets=None, ntriples=None):
+    """Lists the XML files of a release, in load order, as parallel lists
+    of dataset names and file paths.
+
+    Files outside datasets, or in a "<n>triples" directory for an n not in
+    ntriples, are left out.
+    """
+
+    dataset_names = []
+    filepaths = []
 
     for dataset_name in get_release_datasets_dir(release):
 
+        if datasets and dataset_name not in datasets:
+            continue
+
         for filepath in get_dataset_files(release, dataset_name):
 
-            entries_dicts = read_webnlg_file(dataset_name, filepath)
+            if (ntriples and
+                    get_file_ntriples(filepath) not in (None, *ntriples)):
+                continue
 
-            db.insert_multiple(entries_dicts)
+            dataset_names.append(dataset_name)
+            filepaths.append(filepath)
 
-    return WebNLGCorpus(release, db)
+    return dataset_names, filepaths
 
 
-def make_dict_from_triple(triple_text):
+def shard_release_files(filepaths, rank, world_size):
+    """Returns the files of filepaths that belong to shard rank out of
+    world_size, in their original order.
+
+    Files go, largest first, to the shard with the fewest bytes so far (the
+    lowest rank on ties), so shards get about the same amount of XML, and
+    every file goes to exactly one shard. The split depends only on the
+    file names and sizes, so every process computes the same one.
+    """
+
+    if not 0 <= rank < world_size:
+        raise ValueError('Invalid shard {} of {}.'.format(rank, world_size))
+
+    sizes = [get_dataset_file_size(filepath) for filepath in filepaths]
+
+    loads = [0] * world_size
+    assigned = set()
+
+    for i in sorted(range(len(filepaths)),
+                    key=lambda i: (-sizes[i], filepaths[i])):
 
-    triple_dict = {'text': triple_text}
+        owner = min(range(world_size), key=lambda j: (loads[j], j))
+        loads[owner] += sizes[i]
 
-    for triple_key, part in zip(TRIPLE_KEYS, triple_text.split('|')):
+        if owner == rank:
+            assigned.add(i)
 
-        stripped_part = part.strip()
+    return [filepath for i, filepath in enumerate(filepaths)
+            if i in assigned]
 
-        triple_dict[triple_key] = stripped_part
 
-    return triple_dict
+def iter_entries(release, datasets=None, categories=None, ntriples=None):
+    """Yields the entries of a downloaded release one at a time, straight
+    from the XML, without building a corpus.
+
+    Memory stays constant however large the release is; the filters work
+    as in load.
+    """
+
+    if release not in RELEASES_URLS:
+        raise ValueError('{} not in in {}'.format(release,
+                         list(RELEASES_URLS.keys())))
+
+    for dataset_name, filepath in zip(*list_release_files(release, datasets,
+                                                          ntriples)):
+
+        for entry in iter_webnlg_file(dataset_name, filepath, categories,
+                                      ntriples):
+
+            yield WebNLGEntry(entry)
+
+
+def open_arrow(dirpath):
+    """Opens a corpus exported with WebNLGCorpus.to_arrow.
+
+    Returns an ARROW_CONTAINER of pyarrow.dataset.Dataset objects, one per
+    as_pandas frame. The files are memory mapped and nothing is read until
+    a dataset is scanned, e.g. with
+    odf.to_table(columns=['predicate'], filter=ds.field('dataset') == 'test').
+    """
+
+    pa_fs, pa_ds = _import_pyarrow('pyarrow.fs', 'pyarrow.dataset')
+
+    filesystem = pa_fs.LocalFileSystem(use_mmap=True)
+
+    return ARROW_CONTAINER(*[
+        pa_ds.dataset(os.path.join(dirpath, name),
+                      format='ipc',
+                      partitioning='hive',
+                      filesystem=filesystem)
+        for name in ARROW_CONTAINER._fields
+    ])
+
+
+def _import_pyarrow(*modules):
+
+    try:
+        return [importlib.import_module(module) for module in modules]
+    except ImportError as e:
+        raise ImportError('Arrow export requires pyarrow; install it with '
+                          'pip install webnlg_corpus[arrow]') from e
+
+
+def make_dict_from_triple(triple_text):
+
+    # subject, predicate and object, in the order of TRIPLE_KEYS
+    parts = triple_text.split('|')[:len(TRIPLE_KEYS)]
+
+    return Triple(sys.intern(triple_text),
+                  *[sys.intern(part.strip()) for part in parts])
 
 
 def make_dict_from_entity(entity_text):
 
     entity_placeholder, entity_value = entity_text.split('|')
 
-    yield entity_placeholder.strip(), entity_value.strip()
+    yield (sys.intern(entity_placeholder.strip()),
+           sys.intern(entity_value.strip()))
+
+
+def make_dict_from_entry(dataset, entry, content, v12=False):
+
+    mtriples = entry.find('modifiedtripleset').findall('mtriple')
+    otriples = entry.find('originaltripleset').findall('otriple')
+    ntriples = int(entry.attrib['size'])
+    # repeated across entries, so share one copy of each
+    dataset = sys.intern(dataset)
+    category = sys.intern(entry.attrib['category'])
+    eid = sys.intern(entry.attrib['eid'])
+
+    idx = "{dataset}_{category}_{ntriples}_{eid}".format(
+           dataset=dataset,
+           category=category,
+           ntriples=ntriples,
+           eid=eid)
+
+    entry_record = Entry(
+        dataset=dataset,
+        idx=idx,
+        category=category,
+        eid=eid,
+        ntriples=ntriples,
+        content=content,
+        otriples=[make_dict_from_triple(e.text) for e in otriples],
+        mtriples=[make_dict_from_triple(e.text) for e in mtriples],
+        lexes=None
+    )
+
+    if v12:
+
+        entry_record.lexes = [
+            Lex(
+                    text=e.findtext('text'),
+                    template=e.findtext('template', 'NOT-FOUND'),
+                    comment=sys.intern(e.attrib['comment']),
+                    lid=sys.intern(e.attrib['lid'])
+            ) for e in entry.findall('lex')
+        ]
+
+        entry_record.entity_map = dict(
+            pair
+            for entity in entry.find('entitymap').findall('entity')
+            for pair in make_dict_from_entity(entity.text)
+        )
 
+        delexicalize_map = {v: k for k, v in entry_record.entity_map.items()}
 
-def read_webnlg_file(dataset, filepath):
+        entry_record.delexicalized_mtriples = [
+                Triple(
+                    subject=delexicalize_map.get(t.subject, t.subject),
+                    predicate=t.predicate,
+                    object=delexicalize_map.get(t.object, t.object)
+                ) for t in entry_record.mtriples
+        ]
 
-    entries_dicts = []
+    else:
 
-    tree = ET.parse(filepath)
-    root = tree.getroot()
+        entry_record.lexes = [
+            Lex(
+                    text=e.text,
+                    comment=sys.intern(e.attrib['comment']),
+                    lid=sys.intern(e.attrib['lid'])
+            ) for e in entry.findall('lex')
+        ]
 
-    for entry in root.iter('entry'):
+    return entry_record
 
-        mtriples = entry.find('modifiedtripleset').findall('mtriple')
-        otriples = entry.find('originaltripleset').findall('otriple')
-        ntriples = int(entry.attrib['size'])
 
-        idx = "{dataset}_{category}_{ntriples}_{eid}".format(
-               dataset=dataset,
-               category=entry.attrib['category'],
-               ntriples=ntriples,
-               eid=entry.attrib['eid'])
+def _allocate(n, sizes):
+    """Splits n draws across groups of the given sizes proportionally,
+    by largest remainder."""
 
-        entry_dict = {
-            "dataset": dataset,
-            "idx": idx,
-            "category": entry.attrib['category'],
-            "eid": entry.attrib['eid'],
-            "ntriples": ntriples,
-            "content": ET.tostring(entry),
-            "otriples": [make_dict_from_triple(e.text) for e in otriples],
-            "mtriples": [make_dict_from_triple(e.text) for e in mtriples]
-        }
-
-        if 'v1.2' in filepath:
-
-            entry_dict["lexes"] = [
-                {
-                        'text': e.findtext('text'),
-                        'template': e.findtext('template', 'NOT-FOUND'),
-                        'comment': e.attrib['comment'],
-                        'lid': e.attrib['lid']
-                } for e in entry.findall('lex')
-            ]
-
-            entry_dict["entity_map"] = {
-                make_dict_from_entity(entity.text)
-                for entity in entry.find('entitymap').findall('entity')
-            }
+    total = sum(sizes)
 
-            entry_dict["delexicalized_mtriples"] = [
-                    {
-                        'subject': entry_dict["entity_map"][d['subject']],
-                        'predicate': d['predicate'],
-                        'object': entry_dict["entity_map"][d['object']]
-                    } for d in entry_dict["mtriples"]
-            ]
+    if not total:
+        raise ValueError('No entries to sample from.')
 
-        else:
+    shares = [n * size / total for size in sizes]
+    counts = [int(share) for share in shares]
+
+    by_remainder = sorted(range(len(sizes)),
+                          key=lambda i: counts[i] - shares[i])
+
+    for i in by_remainder[:n - sum(counts)]:
+        counts[i] += 1
+
+    return counts
+
+
+def _categorical(codes, symbols):
+    """Builds a pandas Categorical from SymbolTable codes, with only the
+    strings that occur as categories."""
+
+    present, codes = np.unique(codes, return_inverse=True)
+    categories = [symbols.strings[code] for code in present]
+
+    if None in categories:
+        # None is not a valid category; it becomes a missing value
+        missing = categories.index(None)
+        codes = np.where(codes == missing, -1,
+                         codes - (codes > missing))
+        del categories[missing]
+
+    return pd.Categorical.from_codes(codes, categories)
+
+
+class EntrySpanScanner(object):
+    """Finds the byte range of every <entry> element in a stream of chunks.
+
+    Entries do not nest, so ranges complete in document order, the same
+    order in which the XML parser closes the entries.
+    """
+
+    TAG = re.compile(rb'<entry[\s>]|</entry\s*>')
+
+    # longest tag prefix that may be split across two chunks
+    OVERLAP = 16
+
+    def __init__(self):
+
+        self.spans = deque()
+        self._buffer = b''
+        self._offset = 0
+        self._start = None
+
+    def feed(self, data):
+
+        buffer = self._buffer + data
+        scanned = 0
+
+        for match in self.TAG.finditer(buffer):
+
+            if match.group().startswith(b'</'):
+                self.spans.append((self._start, self._offset + match.end()))
+            else:
+                self._start = self._offset + match.start()
+
+            scanned = match.end()
+
+        keep_from = max(scanned, len(buffer) - self.OVERLAP)
+
+        self._offset += keep_from
+        self._buffer = buffer[keep_from:]
+
+
+def iter_webnlg_file(dataset, filepath, categories=None, ntriples=None,
+                     stats=None):
+    """Streams the entries of a WebNLG XML file as Entry records.
+
+    Entries whose category or number of triples is not among the given
+    ones are skipped without being built.
+
+    Each entry is yielded as soon as its closing tag is parsed and is then
+    detached from the partial tree, so memory tracks a single entry instead
+    of the whole file. The raw XML of the entry is not kept: its "content"
+    is an EntryContent pointing at the entry's bytes in the file.
+
+    stats, a FileStats, is updated with the bytes read, the entries yielded
+    and the time spent parsing and building them; time the caller spends
+    between entries is not counted.
+    """
+
+    v12 = 'v1.2' in filepath
+
+    if stats is None:
+        stats = FileStats(dataset, filepath)
+
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    scanner = EntrySpanScanner()
+
+    # open elements, from the root down to the one being parsed
+    parents = []
+
+    clock = time.perf_counter()
+
+    with open_dataset_file(filepath) as f:
+
+        while True:
 
-            entry_dict["lexes"] = [
-                {
-                        'text': e.text,
-                        'comment': e.attrib['comment'],
-                        'lid': e.attrib['lid']
-                } for e in entry.findall('lex')
-            ]
+            data = f.read(READ_SIZE)
+            stats.bytes_read += len(data)
 
-        entries_dicts.append(entry_dict)
+            if data:
+                scanner.feed(data)
+                parser.feed(data)
+            else:
+                parser.close()
 
-    return entries_dicts
+            for event, element in parser.read_events():
+
+                if event == 'start':
+                    parents.append(element)
+                    continue
+
+                parents.pop()
+
+                if element.tag == 'entry':
+
+                    content = EntryContent(filepath,
+                                           *scanner.spans.popleft())
+
+                    wanted = (
+                        (not categories or
+                         element.attrib['category'] in categories) and
+                        (not ntriples or
+                         int(element.attrib['size']) in ntriples)
+                    )
+
+                    if wanted:
+
+                        build_start = time.perf_counter()
+                        stats.parse_seconds += build_start - clock
+
+                        entry_record = make_dict_from_entry(dataset, element,
+                                                            content, v12)
+
+                        stats.build_seconds += (time.perf_counter() -
+                                                build_start)
+                        stats.entries += 1
+
+                        yield entry_record
+
+                        clock = time.perf_counter()
+
+                    element.clear()
+                    if parents:
+                        parents[-1].remove(element)
+
+            if not data:
+                break
+
+    stats.parse_seconds += time.perf_counter() - clock
+
+
+def read_webnlg_file(dataset, filepath, categories=None, ntriples=None,
+                     stats=None):
+
+    return list(iter_webnlg_file(dataset, filepath, categories, ntriples,
+                                 stats))
+
+
+def _read_webnlg_file_columns(release_dir, dataset, filepath, categories,
+                              ntriples):
+    """Parses a file in a worker process into a store of its own, which
+    pickles as a few flat arrays and lists instead of one object per
+    entry, triple and lex."""
+
+    stats = FileStats(dataset, filepath)
+    blocks = sys.getallocatedblocks()
+
+    db = ColumnarStorage(release_dir)
+    db.insert_multiple(iter_webnlg_file(dataset, filepath, categories,
+                                        ntriples, stats))
+
+    stats.allocated_blocks = sys.getallocatedblocks() - blocks
+
+    return db, stats
 
 
 class WebNLGEntry(object):
+    """An entry of a corpus.
 
-    def __init__(self, entry):
+    Made from a store and a position instead of an Entry record, it only
+    rebuilds the record, with its triples and lexes, when they are first
+    asked for; idx, eid and category are read straight from the store.
+    """
 
-        self._entry = entry
+    __slots__ = ('_record', '_db', '_position', '_delexicalize_map')
 
-        if 'entity_map' in self._entry:
+    def __init__(self, entry=None, db=None, position=None):
+
+        self._record = None
+        self._db = db
+        self._position = position
+
+        if entry is not None:
+            self._set_record(entry)
+
+    def _set_record(self, entry):
+
+        self._record = entry
+
+        if 'entity_map' in entry:
             self._delexicalize_map = {
-                    v: k for k, v in self._entry['entity_map'].items()
+                    v: k for k, v in entry['entity_map'].items()
                     }
 
+    @property
+    def _entry(self):
+
+        if self._record is None:
+            self._set_record(self._db.entry(self._position))
+
+        return self._record
+
     @property
     def data(self):
 
@@ -161,18 +669,32 @@ class WebNLGEntry(object):
     @property
     def idx(self):
 
+        if self._record is None:
+            return self._db.idx[self._position]
+
         return self._entry['idx']
 
     @property
     def eid(self):
 
+        if self._record is None:
+            return self._db.eid[self._position]
+
         return self._entry['eid']
 
     @property
     def category(self):
 
+        if self._record is None:
+            return self._db.symbols.strings[self._db.category[self._position]]
+
         return self._entry['category']
 
+    @property
+    def content(self):
+
+        return self._entry['content'].read()
+
     def __str__(self):
 
         lines = []
@@ -212,66 +734,103 @@ class WebNLGEntry(object):
 
 
 class WebNLGCorpus(object):
+    """A release, or a view over part of one.
+
+    rows holds the positions in db of the entries the corpus covers; views
+    made by subset share db with the corpus they come from.
+    """
 
-    def __init__(self, release, db):
+    def __init__(self, release, db, rows=None):
 
         self._release = release
         self._db = db
-        self._query = Query()
+        self._rows = np.arange(len(db)) if rows is None else rows
+        # lazily built by __getitem__: which db positions are in this view
+        self._member = None
 
     @property
     def release(self):
 
         return self._release
 
+    @property
+    def symbols(self):
+        """SymbolTable with the integer codes of the corpus strings."""
+
+        return self._db.symbols
+
     def subset(self, ntriples=None, categories=None, datasets=None):
 
         if ntriples is None and categories is None and datasets is None:
             raise ValueError('At least one filter must be informed.')
 
-        filters = []
-
-        if ntriples:
-            filters.append(self._query.ntriples.one_of(ntriples))
-
-        if categories:
-            filters.append(self._query.category.one_of(categories))
+        rows = self._db.search(self._rows, ntriples=ntriples,
+                               categories=categories, datasets=datasets)
 
-        if datasets:
-            filters.append(self._query.dataset.one_of(datasets))
+        return WebNLGCorpus(self.release, self._db, rows)
 
-        subset_db = TinyDB(storage=MemoryStorage)
-        subset_db.insert_multiple(self._db.search(reduce(__and__, filters)))
+    def sample(self, eid=None, categories=None, ntriples=None, idx=None,
+               seed=None, datasets=None, n=None, replace=False,
+               stratify_by=None):
+        """Draws random entries among those matching the filters.
 
-        return WebNLGCorpus(self.release, subset_db)
+        Without n, returns one WebNLGEntry. With n, returns a list of n
+        of them, drawn without replacement unless replace=True.
 
-    def sample(self, eid=None, categories=None, ntriples=None, idx=None,
-               seed=None, datasets=None):
+        stratify_by, one of 'dataset', 'category' or 'ntriples', splits the
+        n draws across the groups of that column in proportion to their
+        size among the matching entries, the remainder going to the groups
+        with the largest fractional shares.
+        """
 
         rg = Random()
         rg.seed(seed)
 
-        filters = []
+        rows = self._db.search(self._rows, eid=eid, categories=categories,
+                               ntriples=ntriples, idx=idx, datasets=datasets)
 
-        if eid or categories or ntriples or idx or datasets:
+        if n is None:
+            return WebNLGEntry(self._db.entry(int(rg.choice(rows))))
 
-            if idx:
-                filters.append(self._query.idx == idx)
-            if eid:
-                filters.append(self._query.eid == eid)
-            if categories:
-                filters.append(self._query.category.one_of(categories))
-            if ntriples:
-                filters.append(self._query.ntriples.one_of(ntriples))
-            if datasets:
-                filters.append(self._query.dataset.one_of(datasets))
+        if stratify_by is None:
+            strata = [rows]
+        elif stratify_by in ('dataset', 'category', 'ntriples'):
+            strata = self._strata(rows, stratify_by)
+        else:
+            raise ValueError('Cannot stratify by {}.'.format(stratify_by))
 
-            sample_entry = rg.choice(self._db.search(reduce(__and__, filters)))
+        sizes = _allocate(n, [len(stratum) for stratum in strata])
 
-        else:
-            sample_entry = rg.choice(list(self._db))
+        positions = []
+
+        for stratum, size in zip(strata, sizes):
+
+            if replace:
+                draws = rg.choices(range(len(stratum)), k=size)
+            else:
+                draws = rg.sample(range(len(stratum)), size)
+
+            positions.extend(stratum[draws].tolist())
+
+        return [WebNLGEntry(self._db.entry(position))
+                for position in positions]
 
-        return WebNLGEntry(sample_entry)
+    def _strata(self, rows, name):
+        """Splits rows by the value of the name column, using the group
+        index of the store."""
+
+        strata = []
+
+        for positions in self._db.groups(name).values():
+
+            if len(rows) != len(self._db):
+                positions = np.intersect1d(positions, rows,
+                                           assume_unique=True)
+
+            if len(positions):
+                strata.append(positions)
+
+        return strata
 
     @property
     def edf(self):
@@ -293,14 +852,56 @@ class WebNLGCorpus(object):
 
         return self.as_pandas.ldf
 
-    def __get_item__(self, idx):
+    def __getitem__(self, idx):
+
+        position = self._db.position(idx)
+
+        if position is None:
+            return None
 
-        results = self._db.search(self._query.idx == idx)
+        if not self._is_full() and not self._membership()[position]:
+            return None
 
-        if results:
-            return WebNLGEntry(results[0])
+        return WebNLGEntry(self._db.entry(position))
 
-        return None
+    def get_positions(self, idxs):
+        """Returns the store positions of several idxs as an int array, -1
+        for those missing from this corpus; a cheap key for joins."""
+
+        positions = self._db.positions_of(idxs)
+
+        if not self._is_full():
+
+            found = positions >= 0
+            found[found] = self._membership()[positions[found]]
+
+            positions[~found] = -1
+
+        return positions
+
+    def get_many(self, idxs):
+        """Looks up several idxs at once; missing ones map to None.
+
+        The entries are built lazily: their triples and lexes are only
+        read from the store when first used.
+        """
+
+        return [WebNLGEntry(db=self._db, position=position)
+                if position >= 0 else None
+                for position in self.get_positions(idxs).tolist()]
+
+    def _is_full(self):
+
+        return len(self._rows) == len(self._db)
+
+    def _membership(self):
+        """Returns a bool mask of the store positions in this view."""
+
+        if self._member is None:
+            self._member = np.zeros(len(self._db), dtype=bool)
+            self._member[self._rows] = True
+
+        return self._member
 
     @property
     def as_pandas(self):
@@ -309,73 +910,196 @@ class WebNLGCorpus(object):
 
             return self._pandas
 
-        entries_dicts = []
-        otriples_dicts = []
-        mtriples_dicts = []
-        lexes_dicts = []
+        db = self._db
+        rows = self._rows
 
-        for entry in self._db:
+        dataset = _categorical(db.column('dataset')[rows], db.symbols)
+        category = _categorical(db.column('category')[rows], db.symbols)
+        idx = pd.Categorical([db.idx[i] for i in rows])
 
-            entry_dict = {
-                "idx": entry['idx'],
-                "dataset": entry['dataset'],
-                "category": entry['category'],
-                "eid": entry['eid'],
-                "ntriples": entry['ntriples'],
-                "content": entry['content']
+        edf = pd.DataFrame({
+            "idx": idx.astype(object),
+            "dataset": dataset,
+            "category": category,
+            "eid": [db.eid[i] for i in rows],
+            "ntriples": db.column('ntriples')[rows],
+            # EntryContent handles; read_contents reads the XML itself
+            "content": db.contents(rows),
+            "entry": rows
+        })
+
+        # child frames refer to their entry through the "entry" key, and
+        # repeat idx, dataset and category as codes of categoricals
+        def child_frame(table, columns, categorical_columns=()):
+
+            owners, children = table.locate(rows)
+            # position of each owner among rows
+            owner_rows = np.searchsorted(rows, owners)
+
+            frame = {
+                "idx": pd.Categorical.from_codes(idx.codes[owner_rows],
+                                                 idx.categories),
+                "dataset": dataset[owner_rows],
+                "category": category[owner_rows]
             }
-            entries_dicts.append(entry_dict)
-
-            otriple_dict = [
-                {
-                    'idx': entry['idx'],
-                    'dataset': entry['dataset'],
-                    'category': entry['category'],
-                    'text': ot['text'],
-                    'object': ot['object'],
-                    'predicate': ot['predicate'],
-                    'subject': ot['subject']
-                } for ot in entry['otriples']
-            ]
-            otriples_dicts.extend(otriple_dict)
-
-            mtriple_dict = [
-                {
-                    'idx': entry['idx'],
-                    'dataset': entry['dataset'],
-                    'category': entry['category'],
-                    'text': mt['text'],
-                    'object': mt['object'],
-                    'predicate': mt['predicate'],
-                    'subject': mt['subject']
-                } for mt in entry['mtriples']
-            ]
-            mtriples_dicts.extend(mtriple_dict)
-
-            lex_dict = [
-                {
-                    'idx': entry['idx'],
-                    'dataset': entry['dataset'],
-                    'category': entry['category'],
-                    'text': l['text'],
-                    'comment': l['comment'],
-                    'lid': l['lid']
-                } for l in entry['lexes']
-            ]
-            lexes_dicts.extend(lex_dict)
-
-        edf = pd.DataFrame(entries_dicts)
-        odf = pd.DataFrame(otriples_dicts)
-        mdf = pd.DataFrame(mtriples_dicts)
-        ldf = pd.DataFrame(lexes_dicts)
+
+            for column in columns:
+
+                values = table.columns[column]
+
+                if column in table.encoded:
+
+                    codes = np.array(values, dtype=np.int32)[children]
+
+                    if column in categorical_columns:
+                        frame[column] = _categorical(codes, db.symbols)
+                    else:
+                        frame[column] = db.symbols.decode_many(codes)
+
+                else:
+                    frame[column] = [values[j] for j in children]
+
+            frame["entry"] = owners
+
+            return pd.DataFrame(frame)
+
+        triple_columns = ['text', 'object', 'predicate', 'subject']
+
+        odf = child_frame(db.otriples, triple_columns, ['predicate'])
+        mdf = child_frame(db.mtriples, triple_columns, ['predicate'])
+        ldf = child_frame(db.lexes, ['text', 'comment', 'lid'], ['comment'])
 
         self._pandas = PANDAS_CONTAINER(edf=edf, odf=odf, mdf=mdf, ldf=ldf)
 
         return self._pandas
 
+    def read_contents(self):
+        """Reads the raw XML of every entry, in corpus order, opening each
+        source file once."""
+
+        return self._db.read_contents(self._rows)
+
+    def to_arrow(self, dirpath, content=False):
+        """Writes the as_pandas frames as uncompressed Arrow IPC files,
+        one directory per frame, partitioned by dataset and category.
+
+        The raw XML of the entries goes in the edf content column only
+        with content=True; otherwise the column is left out.
+        """
+
+        pa, pa_ds = _import_pyarrow('pyarrow', 'pyarrow.dataset')
+
+        for name, frame in self.as_pandas._asdict().items():
+
+            if name == 'edf':
+
+                if content:
+                    frame = frame.assign(content=self.read_contents())
+                else:
+                    frame = frame.drop(columns=['content'])
+
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+
+            # partition values are written as plain strings
+            for column in ARROW_PARTITIONING:
+                table = table.set_column(
+                        table.schema.get_field_index(column),
+                        column,
+                        table[column].cast(pa.string()))
+
+            pa_ds.write_dataset(table,
+                                os.path.join(dirpath, name),
+                                format='ipc',
+                                partitioning=ARROW_PARTITIONING,
+                                partitioning_flavor='hive')
+
+    def memory_usage(self, traced=False):
+        """Returns a MEMORY_USAGE with the bytes used by each part of the
+        corpus, and their total.
+
+        symbols, entries, triples, lexes, content (the source file table and
+        entry byte ranges; the XML itself stays on disk) and the idx index
+        belong to the store, which views made by subset share with their
+        corpus. indexes also counts the rows of this view, and frames the
+        as_pandas frames if they were built.
+
+        With traced=True, traced is the size tracemalloc measures for a
+        fresh copy of the same objects, otherwise None. It is slower, and
+        leaves out the NumPy column cache the copy does not carry.
+        """
+
+        seen = {}
+
+        usage = self._db.memory_usage(seen)
+        usage['indexes'] += deep_sizeof((self._rows, self._member), seen)
+        usage['frames'] = deep_sizeof(getattr(self, '_pandas', None), seen)
+        usage['total'] = sum(usage.values())
+
+        usage['traced'] = None
+
+        if traced:
+            usage['traced'] = traced_sizeof((self._db, self._rows,
+                                             self._member,
+                                             getattr(self, '_pandas', None)))
+
+        return MEMORY_USAGE(**usage)
+
+    def iter_batches(self, batch_size, fields=('idx', 'data', 'lexes'),
+                     shuffle=False, seed=None):
+        """Yields the entries batch_size at a time, as dicts from each of
+        fields to a column with one value per entry.
+
+        idx, eid, dataset and category come as object arrays and ntriples
+        as an int array; data (the text of the triples), lexes and
+        templates as lists of lists of strings. With shuffle=True the
+        entries are visited in an order drawn from seed, otherwise in
+        corpus order.
+        """
+
+        unknown = set(fields) - set(BATCH_FIELDS)
+
+        if unknown:
+            raise ValueError('Unknown fields {}; choose among {}.'.format(
+                             sorted(unknown), list(BATCH_FIELDS)))
+
+        if batch_size < 1:
+            raise ValueError('batch_size must be positive.')
+
+        db = self._db
+        rows = self._rows
+
+        if shuffle:
+            rows = np.random.default_rng(seed).permutation(rows)
+
+        for start in range(0, len(rows), batch_size):
+
+            batch_rows = rows[start:start + batch_size]
+            batch = {}
+
+            for field in fields:
+
+                kind, name = BATCH_FIELDS[field]
+
+                if kind == 'column':
+                    batch[field] = db.column(name)[batch_rows]
+
+                elif kind == 'symbol':
+                    batch[field] = db.strings()[db.column(name)[batch_rows]]
+
+                else:
+
+                    values, counts = db.children(kind, name, batch_rows)
+                    ends = np.cumsum(counts).tolist()
+                    values = values.tolist()
+
+                    batch[field] = [values[end - count:end] for end, count
+                                    in zip(ends, counts.tolist())]
+
+            yield batch
+
     def __len__(self):
 
-        return len(self._db)
+        return len(self._rows)
 
     def __str__(self):
 
@@ -383,6 +1107,6 @@ class WebNLGCorpus(object):
 
     def __iter__(self):
 
-        for entry in self._db:
+        for position in self._rows:
 
-            yield WebNLGEntry(entry)
+            yield WebNLGEntry(self._db.entry(position))